@@ -0,0 +1,92 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+'''
+Datetime values converted to RFC 3339 per second, with `datetime.strptime` and `rfc3339` for
+every value as the tap used to, then with a DatetimeConverter: without cache, with its cache
+and converting a whole page column at once. Values are all distinct, then come in runs of 10
+and 1000 equal values, like the timestamps of records loaded together.
+
+    python benchmarks/bench_datetime.py [values]
+'''
+
+from datetime import datetime, timedelta
+import sys
+import time
+
+from rfc3339 import rfc3339
+
+from common import DATETIME_FORMAT
+from tap_typo.transform import DEFAULT_DATETIME_CACHE_SIZE, DatetimeConverter
+
+
+PAGE_SIZE = 1000
+
+
+def generate_pages(value_count, repeats):
+    '''
+    Returns pages of records with a `created` field, each value repeated by `repeats` consecutive records
+    '''
+    start = datetime(2020, 1, 1)
+    values = [(start + timedelta(seconds=index // repeats * 37)).strftime(DATETIME_FORMAT)
+              for index in range(value_count)]
+
+    return [[{'created': value} for value in values[first:first + PAGE_SIZE]]
+            for first in range(0, value_count, PAGE_SIZE)]
+
+
+def convert_strptime(pages):
+    for records in pages:
+        for record in records:
+            record['created'] = rfc3339(datetime.strptime(record['created'], DATETIME_FORMAT))
+
+
+def get_convert_records(cache_size):
+    def convert_records(pages):
+        converter = DatetimeConverter({'created': DATETIME_FORMAT}, cache_size)
+        for records in pages:
+            for record in records:
+                converter.convert_record(record)
+
+    return convert_records
+
+
+def convert_columns(pages):
+    converter = DatetimeConverter({'created': DATETIME_FORMAT})
+    for records in pages:
+        converter.convert_records(records)
+
+
+def main():
+    value_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    conversions = [
+        ('strptime and rfc3339', convert_strptime),
+        ('DatetimeConverter without cache', get_convert_records(0)),
+        ('DatetimeConverter', get_convert_records(DEFAULT_DATETIME_CACHE_SIZE)),
+        ('DatetimeConverter by column', convert_columns)
+    ]
+
+    for repeats in [1, 10, 1000]:
+        print('{} values, in runs of {}'.format(value_count, repeats))
+        for name, convert in conversions:
+            pages = generate_pages(value_count, repeats)
+            started = time.perf_counter()
+            convert(pages)
+            print('  {}: {:,.0f} values/s'.format(name, value_count / (time.perf_counter() - started)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+'''
+Seconds taken to compute the schemas of a synthetic catalog of audits sharing the schemas of a
+few datasets, compiling every audit's schema, then with a SchemaCompiler computing each distinct
+schema once.
+
+    python benchmarks/bench_schema.py [audits] [datasets] [fields]
+'''
+
+import sys
+import time
+
+# Adds the repository to the import path
+import common  # noqa: F401 pylint: disable=unused-import
+from tap_typo.schema import SchemaCompiler, compile_schema
+
+
+FIELD_TYPES = ['varchar', 'integer', 'float', 'date-time', 'boolean', 'smallint', 'string']
+
+
+def generate_typo_schema(dataset, fields):
+    '''
+    Returns the Typo schema of a dataset, as found in every audit of the dataset
+    '''
+    typo_schema = {}
+    for index in range(fields):
+        field_type = FIELD_TYPES[(dataset + index) % len(FIELD_TYPES)]
+        spec = {'type': field_type}
+        if field_type == 'date-time':
+            spec['format'] = '%Y-%m-%d %H:%M:%S'
+        if index == 0:
+            spec['primary'] = True
+        typo_schema['field_{}_{}'.format(dataset, index)] = spec
+
+    return typo_schema
+
+
+def main():
+    audit_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    dataset_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    field_count = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+
+    # Every audit response holds its own copy of the schema of its dataset
+    dataset_schemas = [generate_typo_schema(dataset, field_count) for dataset in range(dataset_count)]
+    audit_schemas = [
+        {field: dict(spec) for field, spec in dataset_schemas[audit % dataset_count].items()}
+        for audit in range(audit_count)
+    ]
+    print('{} audits of {} datasets, {} fields per schema'.format(audit_count, dataset_count, field_count))
+
+    started = time.perf_counter()
+    for typo_schema in audit_schemas:
+        compile_schema(typo_schema, output_rfc3339_datetime=True)
+    print('compile_schema for every audit: {:.2f}s'.format(time.perf_counter() - started))
+
+    started = time.perf_counter()
+    compiler = SchemaCompiler(output_rfc3339_datetime=True)
+    for typo_schema in audit_schemas:
+        compiler.compile(typo_schema)
+    print('SchemaCompiler: {:.2f}s, {} schemas computed'.format(time.perf_counter() - started, len(compiler.compiled)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+'''
+Requests per second against a local stub server, opening a new connection for every request
+as `requests.get` does, then through the tap's pool of keep-alive connections. Each is measured
+from one thread, then from several threads at once.
+
+    python benchmarks/bench_session.py [requests] [threads]
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import sys
+import time
+from unittest.mock import patch
+
+import requests
+
+from common import TapTypo, generate_config, generate_results_body, start_stub_server
+
+
+def measure(request, request_count, threads):
+    '''
+    Returns the requests per second of `request_count` calls to `request` spread over `threads` threads
+    '''
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for _ in executor.map(lambda _: request(), range(request_count)):
+            pass
+
+    return request_count / (time.perf_counter() - started)
+
+
+def main():
+    request_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    logging.disable(logging.CRITICAL)
+    server, base_url = start_stub_server(generate_results_body(1, 10, 10))
+    url = base_url + '/repositories/bench_repository/datasets/bench_dataset/results'
+    headers = {'Content-Type': 'application/json', 'Authorization': 'Bearer bench_token'}
+
+    with patch.object(TapTypo, 'request_token', lambda tap: 'bench_token'):
+        tap = TapTypo(config=generate_config(cluster_api_endpoint=base_url), catalog={'streams': []})
+
+        def new_connection():
+            requests.get(url, headers=headers, timeout=20).json()
+
+        def pooled_connection():
+            tap.api_get_request(url)
+
+        try:
+            print('{} requests to {}'.format(request_count, url))
+            for thread_count in [1, threads]:
+                for name, request in [('new connection per request', new_connection),
+                                      ('keep-alive session', pooled_connection)]:
+                    print('{}, {} thread(s): {:,.0f} requests/s'.format(
+                        name, thread_count, measure(request, request_count, thread_count)))
+        finally:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
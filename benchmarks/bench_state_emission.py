@@ -0,0 +1,60 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+'''
+Output size, STATE messages and records per second of a sync under each STATE emission policy.
+
+Pages are served from memory: only the tap's own work is measured.
+
+    python benchmarks/bench_state_emission.py [total_records] [records_per_page]
+'''
+
+import sys
+
+from common import generate_catalog, generate_config, get_results_stub, run_sync
+
+
+POLICIES = [
+    ('every record', {'state_every_records': 1}),
+    ('every 100 records', {'state_every_records': 100}),
+    ('every page', {'state_every_page': True}),
+    ('every second', {'state_every_seconds': 1})
+]
+
+
+def main():
+    total_records = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    records_per_page = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    get = get_results_stub(total_records)
+    catalog = generate_catalog(total_records)
+    print('{} records, {} records per page'.format(total_records, records_per_page))
+
+    # Warm up the page bodies, so every run parses the same cached bodies
+    run_sync(generate_config(records_per_page=records_per_page), catalog, get)
+
+    for name, policy in POLICIES:
+        run = run_sync(generate_config(records_per_page=records_per_page, **policy), catalog, get)
+
+        lines = run.output.splitlines()
+        record_count = sum(1 for line in lines if line.startswith('{"type": "RECORD"'))
+        state_count = sum(1 for line in lines if line.startswith('{"type": "STATE"'))
+        assert record_count == total_records, record_count
+        print('{}: {:,} STATE messages, {:,} bytes of output, {:,.0f} records/s'.format(
+            name, state_count, len(run.output.encode('utf-8')), record_count / run.seconds))
+
+
+if __name__ == '__main__':
+    main()
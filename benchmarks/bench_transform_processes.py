@@ -0,0 +1,71 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+'''
+Records per second of a sync with records rendered in the tap's process, then by 1, 2, 4 and 8
+worker processes (`transform_processes`), and the CPU time left in the tap's process. The stream
+is fetched with page numbers, so up to `transform_processes` pages are rendered at once, then with
+keyset pagination in 8 record id ranges, so up to 8 pages are rendered at once. Every record has a
+datetime field converted to RFC3339.
+
+Pages are served from memory: only parsing, transforming and rendering records is measured.
+
+    python benchmarks/bench_transform_processes.py [total_records] [records_per_page]
+'''
+
+import multiprocessing
+import sys
+
+from common import generate_catalog, generate_config, get_results_stub, run_sync
+
+
+ID_RANGE_SHARDS = 8
+
+PAGINATIONS = [
+    ('page numbers', {}),
+    ('{} record id ranges'.format(ID_RANGE_SHARDS), {'pagination': 'keyset', 'id_range_shards': ID_RANGE_SHARDS})
+]
+
+
+def main():
+    total_records = int(sys.argv[1]) if len(sys.argv) > 1 else 40000
+    records_per_page = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    get = get_results_stub(total_records)
+    catalog = generate_catalog(total_records)
+    print('{} CPU cores, {} records, {} records per page'.format(
+        multiprocessing.cpu_count(), total_records, records_per_page))
+
+    for name, pagination in PAGINATIONS:
+        print(name)
+
+        # Warm up the page bodies, so every run parses the same cached bodies
+        run_sync(generate_config(records_per_page=records_per_page, output_rfc3339_datetime=True, **pagination),
+                 catalog, get)
+
+        for processes in [0, 1, 2, 4, 8]:
+            config = generate_config(
+                records_per_page=records_per_page, output_rfc3339_datetime=True, state_every_page=True,
+                transform_processes=processes, **pagination)
+            run = run_sync(config, catalog, get)
+
+            record_count = run.output.count('"type": "RECORD"')
+            assert record_count == total_records, record_count
+            print('  transform_processes={}: {:.2f}s, {:,.0f} records/s, {:.2f} CPU seconds in the tap process'.format(
+                processes, run.seconds, record_count / run.seconds, run.cpu_seconds))
+
+
+if __name__ == '__main__':
+    main()
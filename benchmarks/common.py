@@ -0,0 +1,201 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+'''
+Helpers shared by the benchmarks. Benchmarks are run from the repository root, for instance
+`python benchmarks/bench_transform_processes.py`, and are not part of the unit tests.
+'''
+
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from tap_typo.typo import TapTypo  # noqa: E402
+
+
+STREAM_ID = 'tap-typo-bench_repository-bench_dataset'
+RESULTS_PATH = '/repositories/bench_repository/datasets/bench_dataset/results'
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Wall-clock and tap process CPU seconds of a sync, and its output
+SyncRun = namedtuple('SyncRun', ['seconds', 'cpu_seconds', 'output'])
+
+
+def generate_record(record_id, fields=20):
+    '''
+    Returns a results record with `fields` string fields and a `created` datetime field
+    '''
+    record = {'field_{}'.format(index): 'value {} {}'.format(record_id, index) for index in range(fields)}
+    record['created'] = '2020-01-{:02d} {:02d}:{:02d}:{:02d}'.format(
+        record_id % 28 + 1, record_id % 24, record_id % 60, record_id * 7 % 60)
+
+    return {'id': record_id, 'has_errors': False, 'errors_fields': [], 'record': record}
+
+
+def generate_results_body(first_id, count, total_records, fields=20):
+    '''
+    Returns the JSON body of the results page of up to `count` records starting with `first_id`
+    '''
+    last_id = min(first_id + count - 1, total_records)
+    records = [generate_record(record_id, fields) for record_id in range(first_id, last_id + 1)]
+    return json.dumps({'data': {'records': records, 'total_records': total_records}}).encode('utf-8')
+
+
+def generate_catalog(total_records, fields=20):
+    '''
+    Returns a catalog with the benchmark stream selected
+    '''
+    properties = {'field_{}'.format(index): {'type': ['null', 'string']} for index in range(fields)}
+    properties['created'] = {'type': ['null', 'string'], 'format': 'date-time'}
+    properties['__typo_record_id'] = {'type': 'integer'}
+
+    return {'streams': [{
+        'tap_stream_id': STREAM_ID,
+        'stream': STREAM_ID,
+        'key_properties': ['__typo_record_id'],
+        'schema': {'type': 'object', 'properties': properties},
+        'metadata': [
+            {'breadcrumb': (), 'metadata': {
+                'selected': True, 'repository': 'bench_repository', 'dataset': 'bench_dataset', 'audit_id': None,
+                'row-count': total_records}},
+            {'breadcrumb': ('properties', 'created'), 'metadata': {'datetime-format': DATETIME_FORMAT}}
+        ]
+    }]}
+
+
+def generate_config(**kwargs):
+    '''
+    Returns the config of a benchmark sync
+    '''
+    config = {
+        'cluster_api_endpoint': 'http://127.0.0.1',
+        'api_key': 'bench_key',
+        'api_secret': 'bench_secret',
+        'record_limit': -1
+    }
+    config.update(kwargs)
+    return config
+
+
+class StubResponse():
+    '''
+    A results page response served from memory, so only the tap's own work is measured
+    '''
+
+    def __init__(self, body, status_code=200, headers=None):
+        self.content = body
+        self.status_code = status_code
+        self.headers = headers if headers is not None else {'Link': '; rel="next"'}
+        self.text = ''
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+def get_results_stub(total_records, fields=20):
+    '''
+    Returns a mock of `requests.Session.get` serving the results pages of a stream of `total_records`
+    records, with page numbers or keyset pagination. Pages are rendered once and reused by later syncs.
+    '''
+    bodies = {}
+
+    def get(session, url, headers, params, timeout, stream=False):  # pylint: disable=unused-argument,too-many-arguments
+        assert RESULTS_PATH in url, url
+        query = parse_qs(urlsplit(url).query)
+        count = int(query['records_per_page'][0])
+        if '__typo_id' in query:
+            first_id = int(query['__typo_id'][0][len('gt:'):]) + 1
+        else:
+            first_id = (int(query['page'][0]) - 1) * count + 1
+
+        if (first_id, count) not in bodies:
+            bodies[(first_id, count)] = generate_results_body(first_id, count, total_records, fields)
+
+        last_page = first_id + count > total_records
+        return StubResponse(bodies[(first_id, count)], headers={} if last_page else {'Link': '; rel="next"'})
+
+    return get
+
+
+def run_sync(config, catalog, get=None):
+    '''
+    Syncs `catalog` and returns its SyncRun. Tokens are not requested and, when `get` is set,
+    GET requests are served by it instead of going through the network.
+    '''
+    output = StringIO()
+    patches = [patch.object(TapTypo, 'request_token', lambda tap: 'bench_token'), patch('sys.stdout', new=output)]
+    if get is not None:
+        patches.append(patch('tap_typo.typo.requests.Session.get', new=get))
+
+    logging.disable(logging.CRITICAL)
+    for active in patches:
+        active.start()
+    try:
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        TapTypo(config, catalog=catalog).sync(catalog_mode=True)
+        seconds = time.perf_counter() - started
+        cpu_seconds = time.process_time() - cpu_started
+    finally:
+        for active in reversed(patches):
+            active.stop()
+        logging.disable(logging.NOTSET)
+
+    return SyncRun(seconds, cpu_seconds, output.getvalue())
+
+
+def start_stub_server(body):
+    '''
+    Starts a local HTTP/1.1 server answering every GET request with `body`, keeping connections
+    alive. Returns the server, to shut it down, and its url.
+    '''
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are written separately, which Nagle's algorithm delays on kept-alive connections
+        disable_nagle_algorithm = True
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, 'http://127.0.0.1:{}'.format(server.server_address[1])
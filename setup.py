@@ -82,6 +82,11 @@ setup(
         'backoff==1.8.0',
         'rfc3339==6.2'
     ],
+    extras_require={
+        'async': ['aiohttp>=3.6'],
+        'fast_json': ['orjson'],
+        'streaming': ['ijson>=3.1']
+    },
     entry_points={
         'console_scripts': [
             'tap-typo=tap_typo:main',
@@ -16,6 +16,7 @@
 #
 # This product includes software developed at or by Typo (https://www.typo.ai/).
 
+import argparse
 import sys
 import singer
 from singer import utils
@@ -35,7 +36,11 @@ def main():
     '''
     Called when the program is executed.
     '''
-    # Parse command line arguments
+    # Parse command line arguments. --resume-from-checkpoint is not a Singer argument.
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--resume-from-checkpoint', nargs='?', const=True, default=None)
+    checkpoint_args, sys.argv[1:] = parser.parse_known_args()
+
     try:
         args = utils.parse_args(REQUIRED_CONFIG_KEYS)
     except Exception as exception:  # pylint: disable=W0703
@@ -52,7 +57,9 @@ def main():
     tap = TapTypo(
         catalog=args.catalog.to_dict() if args.catalog else None,
         config=config,
-        state=args.state
+        state=args.state,
+        lazy_catalog=not args.discover,
+        resume_from_checkpoint=checkpoint_args.resume_from_checkpoint
     )
 
     if args.discover:
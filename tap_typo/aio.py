@@ -0,0 +1,317 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+
+import asyncio
+import json
+import sys
+import time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from tap_typo.logging import log_critical, log_error, log_info
+from tap_typo.paging import has_next_page
+from tap_typo.workers import render_results_page
+
+
+REQUEST_TIMEOUT = 20
+# Same number of attempts as the backoff of the threaded requests
+NETWORK_MAX_TRIES = 8
+# Connections kept open at once when max_concurrent_requests is not set
+DEFAULT_CONNECTION_LIMIT = 100
+
+GOOD_STATUS = [200, 201, 202]
+UNAUTHORIZED_STATUS = 401
+
+_DONE = object()
+
+
+class AsyncEngine():
+    '''
+    Syncs streams on a single asyncio event loop with aiohttp, instead of one thread per stream.
+
+    Up to `max_parallel_streams` streams are synced at once and each one fetches up to
+    `prefetch_pages` pages ahead of its output, so many requests are in flight while records
+    are written. Requests go through the tap's rate limiter and retry policy, at most
+    `max_concurrent_requests` connections are open at once. The catalog, the record transforms
+    and the output are the tap's own: only results pages are fetched by the engine. With
+    `transform_processes`, the bodies of the pages are parsed and rendered by the worker
+    processes while the loop goes on.
+    '''
+
+    def __init__(self, tap):
+        self.tap = tap
+        self.session = None
+
+    def sync(self, streams):
+        '''
+        Syncs `streams` and returns once all of them are done
+        '''
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.sync_streams(streams))
+        finally:
+            loop.close()
+
+    async def sync_streams(self, streams):
+        '''
+        Syncs `streams`, cancelling the others as soon as one of them fails
+        '''
+        # Authenticate once instead of once per stream
+        await self.run_blocking(self.tap.get_token)
+
+        connector = aiohttp.TCPConnector(limit=self.tap.max_concurrent_requests or DEFAULT_CONNECTION_LIMIT)
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        semaphore = asyncio.Semaphore(self.tap.max_parallel_streams)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            self.session = session
+
+            tasks = [asyncio.ensure_future(self.sync_stream(stream, semaphore)) for stream in streams]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def sync_stream(self, stream, semaphore):
+        '''
+        Syncs one stream, writing its pages as they arrive
+        '''
+        async with semaphore:
+            tap = self.tap
+            stream_sync = tap.start_stream(stream)
+
+            pages = self.get_pages(stream_sync)
+            eof = False
+            try:
+                async for data, eof in pages:
+                    if not tap.write_page(stream_sync, data['data']['records']):
+                        break
+                else:
+                    # Every page was consumed
+                    eof = True
+            finally:
+                await pages.aclose()
+                tap.finish_stream(stream_sync)
+
+            if eof:
+                log_info('Finished syncing all available data for stream `{}`.'.format(stream_sync.stream_id))
+
+    async def get_pages(self, stream_sync):
+        '''
+        Yields `(data, eof)` for every results page of a stream, like `ResultsPager.get_pages`.
+        Pages are fetched by a background task, up to `prefetch_pages` ahead of the consumer.
+        '''
+        if self.tap.pager.prefetch_pages <= 0:
+            async for page in self.fetch_pages(stream_sync):
+                yield page
+            return
+
+        pages = asyncio.Queue(maxsize=self.tap.pager.prefetch_pages)
+
+        async def produce():
+            async for page in self.fetch_pages(stream_sync):
+                await pages.put(page)
+            await pages.put(_DONE)
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            while True:
+                getter = asyncio.ensure_future(pages.get())
+                await asyncio.wait([getter, producer], return_when=asyncio.FIRST_COMPLETED)
+
+                if not getter.done():
+                    # The producer stopped without queueing anything else: raise its error
+                    getter.cancel()
+                    producer.result()
+                    return
+
+                page = getter.result()
+                if page is _DONE:
+                    return
+                yield page
+        finally:
+            producer.cancel()
+
+    async def fetch_pages(self, stream_sync):
+        '''
+        Fetches the results pages of a stream one after the other
+        '''
+        tap = self.tap
+        cursor = tap.pager.create_cursor(stream_sync.start_record_id)
+        page_size = cursor.page_size
+        render_options = tap.pager.get_render_options(stream_sync)
+        render = render_options is not None
+        eof = False
+
+        while not eof:
+            records_per_page = cursor.records_per_page
+            url = tap.pager.get_page_url(stream_sync, cursor.page_number, cursor.start_record_id, records_per_page)
+
+            started = time.monotonic()
+            try:
+                status, headers, data = await self.api_get_request(
+                    url, retry_timeouts=page_size is None or page_size.size <= page_size.minimum, raw=render)
+            except asyncio.TimeoutError:
+                # NOTE: Only raised while the page size can still shrink
+                page_size.timed_out()
+                log_info('Page request timed out. Retrying with {} records per page.'.format(page_size.size))
+                continue
+            seconds = time.monotonic() - started
+
+            if status != 200:
+                log_error(data['message'])
+                sys.exit(1)
+
+            if render:
+                # The body is parsed and rendered by a worker process
+                records = await asyncio.get_event_loop().run_in_executor(
+                    tap.render_pool, render_results_page, render_options, data)
+                data = {'data': {'records': records}}
+                record_count = len(records.record_ids)
+                last_id = records.record_ids[-1] if record_count else None
+            else:
+                records = data['data']['records']
+                record_count = len(records)
+                last_id = records[-1]['id'] if record_count else None
+
+            eof = not has_next_page(headers) or cursor.is_last_page(record_count, records_per_page)
+
+            yield data, eof
+
+            if page_size is not None:
+                content_length = headers.get('Content-Length')
+                page_size.page_fetched(record_count, seconds, int(content_length) if content_length else None)
+
+            if not cursor.advance(record_count, last_id, records_per_page):
+                return
+
+    async def api_get_request(self, url, retry_timeouts=True, raw=False):
+        '''
+        Makes a GET request to the Typo API. Like `TapTypo.api_get_request`, a request rejected
+        with a 401 is retried once with a new token, requested outside of the event loop.
+        '''
+        token = await self.run_blocking(self.tap.get_token)
+        status, headers, data = await self.get_request(url, token, retry_timeouts, allow_unauthorized=True, raw=raw)
+
+        # Expired or revoked token: requests that used it share a single refresh
+        if status == UNAUTHORIZED_STATUS:
+            token = await self.run_blocking(self.tap.token_manager.refresh, token)
+            status, headers, data = await self.get_request(url, token, retry_timeouts, raw=raw)
+
+        return status, headers, data
+
+    async def get_request(self, url, token, retry_timeouts=True, allow_unauthorized=False, raw=False):
+        '''
+        GET request sent within the tap's rate limits. Rate limited requests and server errors are
+        retried as allowed by the retry policy, network errors as often as the threaded requests.
+        Unless `retry_timeouts` is set, timeouts are raised to the caller instead of being retried.
+        A 401 Unauthorized response is returned when `allow_unauthorized` is set. See `fetch` for `raw`.
+        '''
+        tap = self.tap
+        request_headers = {
+            'Content-Type': 'application/json',
+            'Authorization': 'Bearer {}'.format(token)
+        }
+
+        started_at = time.monotonic()
+        attempt = 0
+        network_tries = 0
+
+        while True:
+            await self.wait_rate_limit()
+
+            try:
+                status, headers, data = await self.fetch(url, request_headers, raw)
+            except (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError) as exception:
+                is_timeout = isinstance(exception, asyncio.TimeoutError)
+                if is_timeout and not retry_timeouts:
+                    raise
+
+                network_tries += 1
+                if network_tries >= NETWORK_MAX_TRIES:
+                    log_critical('Unable to make network requests. Please check your internet connection.')
+                    sys.exit(1)
+
+                delay = tap.retry_policy.get_delay(network_tries)
+                tap.retry_policy.record('timeout' if is_timeout else 'connection')
+                log_info('Network error receiving data from Typo. Sleeping {:.1f} seconds before trying again: {}'
+                         .format(delay, str(exception) or type(exception).__name__))
+                await asyncio.sleep(delay)
+                continue
+
+            tap.rate_limiter.update(headers)
+
+            if tap.retry_policy.is_retryable(status):
+                attempt += 1
+                delay = tap.get_retry_delay(status, headers, attempt, started_at)
+                if delay is not None:
+                    await asyncio.sleep(delay)
+                    continue
+
+            if status not in GOOD_STATUS and not (status == UNAUTHORIZED_STATUS and allow_unauthorized):
+                if isinstance(data, dict) and 'message' in data.keys():
+                    log_error(('Get request failed. Please verify your config and try again later. '
+                               + 'Error message: {}. Request url=[{}], request status_code=[{}].').format(
+                                   data['message'], url, status))
+                else:
+                    log_error(('Get request failed. Please verify your config and try again later. url=[{}], '
+                               + 'request.status_code=[{}].').format(url, status))
+                sys.exit(1)
+
+            return status, headers, data
+
+    async def fetch(self, url, headers, raw=False):
+        '''
+        Sends a GET request and returns its `(status, headers, data)`, data being the parsed JSON body.
+        Error pages that are not JSON, like the HTML of a 502 from a proxy, have no data. With `raw`,
+        the data of a successful response is its body, left unparsed.
+        '''
+        async with self.session.get(url, headers=headers) as response:
+            body = await response.read()
+
+        if raw and response.status in GOOD_STATUS:
+            return response.status, response.headers, body
+
+        data = None
+        if body:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                if response.status in GOOD_STATUS:
+                    raise
+
+        return response.status, response.headers, data
+
+    async def wait_rate_limit(self):
+        '''
+        Waits until the tap's rate limiter lets a request start, without blocking the event loop
+        '''
+        while True:
+            delay = self.tap.rate_limiter.reserve()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def run_blocking(self, function, *args):
+        '''
+        Runs a blocking call of the tap, like a token request, in a worker thread
+        '''
+        return await asyncio.get_event_loop().run_in_executor(None, function, *args)
@@ -0,0 +1,123 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+
+import base64
+import binascii
+import json
+import threading
+import time
+
+from tap_typo.logging import log_error
+
+
+# Seconds before a token expires when it is refreshed in the background
+DEFAULT_TOKEN_REFRESH_MARGIN = 60
+
+
+def get_token_expiry(token):
+    '''
+    Returns the expiration time of a JWT access token as a UNIX timestamp,
+    None if the token is not a JWT or has no `exp` claim.
+    '''
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except (IndexError, KeyError, TypeError, ValueError, binascii.Error):
+        return None
+
+
+class TokenManager:
+    '''
+    Shares an access token between every thread making requests.
+
+    `request_token` is called to get a new token, by one thread at a time: concurrent callers
+    wait for it and use the token it gets. Tokens with a known expiration time are refreshed
+    in the background `refresh_margin` seconds before they expire, and synchronously once
+    they did.
+
+    With a `cache`, the token is loaded from it at first and every new token is saved to it.
+    '''
+
+    def __init__(self, request_token, refresh_margin=DEFAULT_TOKEN_REFRESH_MARGIN, cache=None):
+        self.request_token = request_token
+        self.refresh_margin = refresh_margin
+        self.cache = cache
+        self.token = None
+        self.expires_at = None
+        self.lock = threading.Lock()
+        self.background_refresh = None
+
+        cached = cache.load() if cache else None
+        if cached:
+            self.set_token(*cached)
+
+    def set_token(self, token, expires_at=None):
+        '''
+        Replaces the current token. Its expiration is read from the token when not provided.
+        '''
+        self.token = token
+        self.expires_at = expires_at if expires_at is not None else get_token_expiry(token)
+
+    def get_token(self):
+        '''
+        Returns a valid token, requesting one when there is none or it expired
+        '''
+        token = self.token
+        expires_at = self.expires_at
+
+        if token is None or (expires_at is not None and time.time() >= expires_at):
+            return self.refresh(token)
+
+        if expires_at is not None and time.time() >= expires_at - self.refresh_margin:
+            self.start_background_refresh(token)
+
+        return token
+
+    def refresh(self, stale_token):
+        '''
+        Requests a new token to replace `stale_token`, for instance after a 401 response.
+        When another thread already replaced it, its token is returned without a new request.
+        '''
+        with self.lock:
+            if self.token is None or self.token == stale_token:
+                self.set_token(self.request_token())
+                if self.cache:
+                    self.cache.save(self.token, self.expires_at)
+
+            return self.token
+
+    def start_background_refresh(self, stale_token):
+        '''
+        Refreshes the token in a background thread, unless one is already running
+        '''
+        with self.lock:
+            if self.token != stale_token:
+                return
+            if self.background_refresh is not None and self.background_refresh.is_alive():
+                return
+
+            self.background_refresh = threading.Thread(
+                target=self.run_background_refresh, args=(stale_token,),
+                name='tap-typo-token-refresh', daemon=True)
+            self.background_refresh.start()
+
+    def run_background_refresh(self, stale_token):
+        try:
+            self.refresh(stale_token)
+        except BaseException as exception:  # pylint: disable=broad-except
+            # NOTE: The token is requested again when it expires, a failure is not fatal yet
+            log_error('Background token refresh failed: {}'.format(exception))
@@ -0,0 +1,180 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from tap_typo.logging import log_info
+
+
+DEFAULT_DISCOVERY_CACHE_TTL = 3600
+
+
+def get_cache_key(*parts):
+    '''
+    Hashes the values identifying a cache file, so no credential is written in its name
+    '''
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+def write_atomically(path, text, mode=0o644, durable=False):
+    '''
+    Writes `text` to `path` through a temporary file, so readers never see a partial file.
+    When `durable` is set, the file is synced to disk before it replaces the previous one.
+    '''
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix='.tap-typo-')
+    try:
+        with os.fdopen(descriptor, 'w') as temporary_file:
+            os.chmod(temporary_path, mode)
+            temporary_file.write(text)
+            if durable:
+                temporary_file.flush()
+                os.fsync(temporary_file.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def write_json_atomically(path, data, mode=0o644):
+    '''
+    Writes `data` as JSON to `path` through a temporary file, so readers never see a partial file
+    '''
+    write_atomically(path, json.dumps(data), mode)
+
+
+def read_json(path):
+    '''
+    Reads a JSON file, returning None when it is missing or unreadable
+    '''
+    try:
+        with open(path, encoding='utf-8') as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+
+class DiscoveryCache():
+    '''
+    On-disk cache of the discovery listing responses of one endpoint, tenant and repository.
+    Entries younger than `ttl` seconds are used without any request. Older entries keep their
+    ETag and Last-Modified validators so they can be revalidated with a conditional request.
+    Listings are fetched concurrently, so changes and writes are serialized.
+    '''
+
+    def __init__(self, directory, base_url, api_key, repository, ttl=DEFAULT_DISCOVERY_CACHE_TTL):
+        self.path = os.path.join(
+            directory, 'tap-typo-discovery-{}.json'.format(get_cache_key(base_url, api_key, repository)))
+        self.ttl = ttl
+        self.entries = read_json(self.path) or {}
+        self.lock = threading.RLock()
+
+    def get(self, url):
+        '''
+        Returns the cached entry for a listing url, if any
+        '''
+        return self.entries.get(url)
+
+    def is_fresh(self, entry):
+        '''
+        Whether an entry can be used without revalidating it
+        '''
+        return time.time() - entry['fetched_at'] < self.ttl
+
+    # pylint: disable=no-self-use
+    def get_validators(self, entry):
+        '''
+        Returns the conditional request headers revalidating an entry
+        '''
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, url, data, headers):
+        '''
+        Stores a listing response
+        '''
+        with self.lock:
+            self.entries[url] = {
+                'fetched_at': time.time(),
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'link': headers.get('Link'),
+                'data': data
+            }
+            self.save()
+
+    def touch(self, url):
+        '''
+        Marks a revalidated entry as fresh again
+        '''
+        with self.lock:
+            self.entries[url]['fetched_at'] = time.time()
+            self.save()
+
+    def save(self):
+        '''
+        Writes the cache to disk. Failing to write it only disables caching for the next run.
+        '''
+        try:
+            with self.lock:
+                write_json_atomically(self.path, self.entries, mode=0o600)
+        except OSError as exception:
+            log_info('Unable to write the discovery cache file {}: {}'.format(self.path, exception))
+
+
+class TokenCache():
+    '''
+    On-disk cache of the access token of one endpoint and API key, so short consecutive runs
+    can skip the token request. The file is only readable by its owner.
+    '''
+
+    def __init__(self, directory, base_url, api_key):
+        self.path = os.path.join(directory, 'tap-typo-token-{}.json'.format(get_cache_key(base_url, api_key)))
+
+    def load(self):
+        '''
+        Returns the cached (token, expires_at), None when there is no usable token.
+        Tokens without a known expiration time are returned as they are.
+        '''
+        cached = read_json(self.path)
+        if not isinstance(cached, dict) or not cached.get('token'):
+            return None
+
+        expires_at = cached.get('expires_at')
+        if expires_at is not None and time.time() >= expires_at:
+            return None
+
+        return cached['token'], expires_at
+
+    def save(self, token, expires_at):
+        '''
+        Writes the token to disk. Failing to write it only means the next run requests a new one.
+        '''
+        try:
+            write_json_atomically(self.path, {'token': token, 'expires_at': expires_at}, mode=0o600)
+        except OSError as exception:
+            log_info('Unable to write the token cache file {}: {}'.format(self.path, exception))
@@ -0,0 +1,160 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+
+import singer
+
+from tap_typo.schema import TYPO_PROPERTIES
+
+
+def get_tap_stream_id(repository, dataset, audit_id):
+    '''
+    Generates a stream ID from a Dataset name & Audit ID
+    '''
+    stream_id = f'tap-typo-{repository}-{dataset}'
+    if audit_id:
+        return f'{stream_id}-audit-{audit_id}'
+
+    return stream_id
+
+
+def get_stream_names(data):
+    '''
+    Returns the repository, dataset and audit ID of a datasets or audits listing item
+    '''
+    repository = data['repository']['name']
+    if data['is_audit']:
+        return repository, data['dataset']['name'], data['id']
+
+    return repository, data['name'], None
+
+
+def has_results(data, partial=False):
+    '''
+    Whether a datasets or audits listing item has results to sync.
+    Audits must be completed and have a schema, datasets must have models.
+    With `partial`, for the information of a single stream, which may lack those fields,
+    only the state and models the data holds can leave it out.
+    '''
+    if partial:
+        if data['is_audit']:
+            return data.get('state', 'COMPLETED') == 'COMPLETED'
+
+        return 'models' not in data or len(data['models'] or []) > 0
+
+    if data['is_audit']:
+        return data.get('state') == 'COMPLETED' and data.get('schema') is not None
+
+    return len(data.get('models') or []) > 0
+
+
+def carry_over_selection(previous_entry, entry):
+    '''
+    Copies the `selected` metadata of a previous catalog entry into a rebuilt one,
+    for the breadcrumbs that still exist
+    '''
+    previous_selection = {
+        tuple(item['breadcrumb']): item['metadata']['selected']
+        for item in previous_entry.get('metadata', []) if 'selected' in item['metadata']
+    }
+
+    for item in entry['metadata']:
+        breadcrumb = tuple(item['breadcrumb'])
+        if breadcrumb in previous_selection:
+            # NOTE: Metadata of identical schemas is shared between entries
+            item['metadata'] = dict(item['metadata'], selected=previous_selection[breadcrumb])
+
+
+class CatalogIndex:
+    '''
+    Indexes the streams of a catalog by `tap_stream_id`. The metadata of each stream is
+    mapped by breadcrumb the first time it is needed and shared by every later lookup.
+    '''
+
+    def __init__(self, catalog):
+        self.streams = {stream['tap_stream_id']: stream for stream in catalog.get('streams', [])}
+        self.metadata = {}
+
+    def get_stream(self, stream_id):
+        '''
+        Returns the catalog entry of a stream, None if the catalog does not have it
+        '''
+        return self.streams.get(stream_id)
+
+    def get_metadata(self, stream_id):
+        '''
+        Returns the metadata of a stream mapped by breadcrumb
+        '''
+        stream_metadata = self.metadata.get(stream_id)
+
+        if stream_metadata is None:
+            stream_metadata = singer.metadata.to_map(self.streams[stream_id].get('metadata', []))
+            self.metadata[stream_id] = stream_metadata
+
+        return stream_metadata
+
+    def get_stream_metadata(self, stream_id, key):
+        '''
+        Returns a value of the stream's root metadata, which has an empty breadcrumb
+        '''
+        return self.get_metadata(stream_id).get((), {}).get(key)
+
+    def is_selected(self, stream_id):
+        '''
+        Checks the stream's root metadata for `selected` set to True or, when it is not set,
+        `selected-by-default` set to True.
+        '''
+        selected = self.get_stream_metadata(stream_id, 'selected')
+
+        if selected is None:
+            return bool(self.get_stream_metadata(stream_id, 'selected-by-default'))
+
+        return bool(selected)
+
+    def get_excluded_fields(self, stream_id):
+        '''
+        Returns the fields that were deselected in the stream's metadata. The Typo properties
+        and fields with an `automatic` inclusion are always output, other fields are output when
+        `selected` or, if it is not set, `selected-by-default` is true.
+        '''
+        excluded_fields = set()
+
+        for breadcrumb, field_metadata in self.get_metadata(stream_id).items():
+            # NOTE: Field metadata has a ('properties', field_name) breadcrumb
+            if not breadcrumb or field_metadata.get('inclusion') == 'automatic':
+                continue
+
+            # Catalogs made before the Typo properties were marked automatic
+            if breadcrumb[1] in TYPO_PROPERTIES:
+                continue
+
+            selected = field_metadata.get('selected')
+            if selected is None:
+                selected = field_metadata.get('selected-by-default', True)
+
+            if not selected or field_metadata.get('inclusion') == 'unsupported':
+                excluded_fields.add(breadcrumb[1])
+
+        return excluded_fields
+
+    def get_datetime_formats(self, stream_id, excluded_fields=()):
+        '''
+        Returns the `datetime-format` metadata of the stream's fields, by field name
+        '''
+        return {
+            breadcrumb[1]: field_metadata['datetime-format']
+            for breadcrumb, field_metadata in self.get_metadata(stream_id).items()
+            if breadcrumb and 'datetime-format' in field_metadata and breadcrumb[1] not in excluded_fields
+        }
@@ -0,0 +1,90 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+
+import threading
+import time
+
+from tap_typo.cache import read_json, write_atomically
+from tap_typo.logging import log_info
+
+
+# Seconds between checkpoint writes, 0 writes one every time the output is flushed
+DEFAULT_CHECKPOINT_EVERY_SECONDS = 0
+
+
+def load_checkpoint(path):
+    '''
+    Returns the state saved in a checkpoint file, None when there is none
+    '''
+    checkpoint = read_json(path)
+    if not isinstance(checkpoint, dict) or not isinstance(checkpoint.get('value'), dict):
+        return None
+
+    return checkpoint['value']
+
+
+def merge_bookmarks(state, checkpoint_state, bookmark_property):
+    '''
+    Returns `state` with the bookmarks of `checkpoint_state` that are further ahead. Record ids
+    only grow, so the largest bookmark of a stream is the most recent one.
+    '''
+    merged = dict(state)
+    bookmarks = dict(state.get('bookmarks', {}))
+
+    for stream_id, bookmark in checkpoint_state.get('bookmarks', {}).items():
+        current = bookmarks.get(stream_id, {}).get(bookmark_property)
+        if current is None or bookmark.get(bookmark_property, current) > current:
+            bookmarks[stream_id] = bookmark
+
+    merged['bookmarks'] = bookmarks
+    return merged
+
+
+class Checkpoint():  # pylint: disable=too-few-public-methods
+    '''
+    Keeps the last STATE message written to stdout in a local file, so a crashed sync can be
+    resumed from where its output stopped, even if that STATE never reached a target.
+
+    The file is replaced atomically and synced to disk at most every `every_seconds` seconds.
+    It holds the STATE message as written, so saving it does not encode the state again.
+    '''
+
+    def __init__(self, path, every_seconds=DEFAULT_CHECKPOINT_EVERY_SECONDS):
+        self.path = path
+        self.every_seconds = every_seconds
+        self.saved_line = None
+        self.saved_at = 0
+        self.lock = threading.Lock()
+
+    def save(self, state_line, force=False):
+        '''
+        Saves a written STATE message line, unless it was saved already or, without `force`,
+        the previous save is more recent than `every_seconds`.
+        '''
+        with self.lock:
+            if state_line is None or state_line is self.saved_line:
+                return
+            if not force and time.monotonic() - self.saved_at < self.every_seconds:
+                return
+
+            try:
+                write_atomically(self.path, state_line + '\n', durable=True)
+            except OSError as exception:
+                log_info('Unable to write the checkpoint file {}: {}'.format(self.path, exception))
+                return
+
+            self.saved_line = state_line
+            self.saved_at = time.monotonic()
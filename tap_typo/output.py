@@ -0,0 +1,277 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+
+import json
+import queue
+import sys
+import time
+
+import singer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from tap_typo.logging import log_info
+
+
+# Maximum number of rendered lines waiting to be written
+DEFAULT_QUEUE_SIZE = 10000
+
+# Characters of output kept in memory before writing them to stdout
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# STATE messages written between two checkpoints while the queue of workers' lines never empties
+DEFAULT_CHECKPOINT_EVERY_STATES = 100
+
+# Seconds between checks for finished workers while the queue is empty
+_GET_TIMEOUT = 0.1
+
+
+def get_json_encoder(fast_json):
+    '''
+    Returns the function used to render records. Uses orjson when `fast_json` is set and
+    it is installed, otherwise the standard library encoder, which renders records exactly as
+    `singer.format_message` does.
+    '''
+    if fast_json:
+        if orjson is not None:
+            return lambda record: orjson.dumps(record).decode('utf-8')
+
+        log_info('fast_json is enabled but orjson is not installed. Using the standard JSON encoder.')
+
+    return json.dumps
+
+
+def get_record_prefix(stream_id):
+    '''
+    Returns the start of a stream's RECORD messages, up to the record itself
+    '''
+    return '{{"type": "RECORD", "stream": {}, "record": '.format(json.dumps(stream_id))
+
+
+class StateLine(str):
+    '''
+    A rendered STATE message, told apart from the other lines once queued
+    '''
+
+
+class MessageWriter():
+    '''
+    Writes Singer messages to stdout, one message per line.
+    Lines are buffered up to `buffer_size` characters and written together, a `buffer_size`
+    of 0 writes and flushes every line.
+
+    With a `checkpoint`, the last STATE message written to stdout is saved to it on every flush.
+    '''
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE, fast_json=False, checkpoint=None):
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        self.dumps = get_json_encoder(fast_json)
+        self.record_prefixes = {}
+        self.checkpoint = checkpoint
+        self.buffered_state = None
+        self.written_state = None
+
+    def write_message(self, message):
+        '''
+        Renders a Singer message and writes it
+        '''
+        self.write_line(singer.format_message(message))
+
+    def write_state(self, state):
+        '''
+        Renders a STATE message and writes it
+        '''
+        line = StateLine(singer.format_message(singer.StateMessage(value=state)))
+        self.write_line(line)
+
+        if self.buffer:
+            self.buffered_state = line
+        else:
+            self.written_state = line
+
+    def write_record(self, stream_id, record):
+        '''
+        Renders a RECORD message and writes it
+        '''
+        self.write_line(self.render_record(stream_id, record))
+
+    def render_record(self, stream_id, record):
+        '''
+        Renders a RECORD message. The envelope is rendered once per stream,
+        so only the record itself is encoded.
+        '''
+        prefix = self.record_prefixes.get(stream_id)
+        if prefix is None:
+            prefix = get_record_prefix(stream_id)
+            self.record_prefixes[stream_id] = prefix
+
+        return prefix + self.dumps(record) + '}'
+
+    def write_line(self, line):
+        '''
+        Writes an already rendered message
+        '''
+        if not self.buffer_size:
+            sys.stdout.write(line + '\n')
+            sys.stdout.flush()
+            return
+
+        self.buffer.append(line)
+        self.buffered += len(line) + 1
+
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self, force_checkpoint=False):
+        '''
+        Writes the buffered lines to stdout
+        '''
+        if self.buffer:
+            self.buffer.append('')
+            sys.stdout.write('\n'.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+        sys.stdout.flush()
+
+        if self.buffered_state is not None:
+            self.written_state = self.buffered_state
+            self.buffered_state = None
+
+        if self.checkpoint is not None:
+            self.checkpoint.save(self.written_state, force_checkpoint)
+
+
+class QueuedMessageWriter(MessageWriter):
+    '''
+    Multiplexes the messages of several sync workers into a single writer.
+    Workers render their messages and queue them. The thread calling `drain` is the only
+    one writing to stdout, so every line is written whole and in the order it was queued.
+
+    The output is flushed and checkpointed whenever the queue is empty. When workers keep it
+    full, it is also checkpointed every `checkpoint_every_states` STATE messages, or once the
+    checkpoint's `every_seconds` went by.
+    '''
+
+    def __init__(self, fast_json=False, maxsize=DEFAULT_QUEUE_SIZE, checkpoint=None,
+                 checkpoint_every_states=DEFAULT_CHECKPOINT_EVERY_STATES):
+        super().__init__(buffer_size=0, fast_json=fast_json, checkpoint=checkpoint)
+        self.lines = queue.Queue(maxsize=maxsize)
+        self.checkpoint_every_states = checkpoint_every_states
+
+    def write_line(self, line):
+        self.lines.put(line)
+
+    def write_state(self, state):
+        # The STATE message is only written once `drain` gets to it
+        self.write_line(StateLine(singer.format_message(singer.StateMessage(value=state))))
+
+    def flush(self, force_checkpoint=False):
+        # Lines are written by `drain`
+        pass
+
+    def drain(self, futures, stop=None):
+        '''
+        Writes queued lines until every worker future is done and the queue is empty.
+        As soon as one of them fails, `stop` is set for the running workers to finish early
+        and workers that have not started yet are cancelled.
+        '''
+        def worker_done(future):
+            if not future.cancelled() and future.exception() is not None:
+                if stop is not None:
+                    stop.set()
+                for pending_future in futures:
+                    pending_future.cancel()
+
+        for future in futures:
+            future.add_done_callback(worker_done)
+
+        unsaved_states = 0
+
+        while True:
+            try:
+                line = self.lines.get(timeout=_GET_TIMEOUT)
+            except queue.Empty:
+                if all(future.done() for future in futures) and self.lines.empty():
+                    return
+                continue
+
+            sys.stdout.write(line + '\n')
+            if isinstance(line, StateLine):
+                self.written_state = line
+                unsaved_states += 1
+
+            if self.lines.empty() or (unsaved_states and self.is_checkpoint_due(unsaved_states)):
+                sys.stdout.flush()
+                if self.checkpoint is not None:
+                    self.checkpoint.save(self.written_state)
+                unsaved_states = 0
+
+    def is_checkpoint_due(self, unsaved_states):
+        '''
+        Returns whether the last written STATE should be checkpointed before the queue is empty
+        '''
+        if self.checkpoint is None:
+            return False
+
+        if unsaved_states >= self.checkpoint_every_states:
+            return True
+
+        every_seconds = self.checkpoint.every_seconds
+        return bool(every_seconds) and time.monotonic() - self.checkpoint.saved_at >= every_seconds
+
+
+class StateEmissionPolicy():
+    '''
+    Decides when a stream's STATE message is due: every `every_records` records, every
+    `every_seconds` seconds and/or at the end of every page. A disabled trigger is set to 0/False.
+    '''
+
+    def __init__(self, every_records=1, every_seconds=0, every_page=False):
+        self.every_records = every_records
+        self.every_seconds = every_seconds
+        self.every_page = every_page
+        self.pending = 0
+        self.last_emission = time.monotonic()
+
+    def record_done(self):
+        '''
+        Counts a written record and returns whether a STATE message is due
+        '''
+        self.pending += 1
+
+        if self.every_records and self.pending >= self.every_records:
+            return True
+
+        return bool(self.every_seconds) and time.monotonic() - self.last_emission >= self.every_seconds
+
+    def page_done(self):
+        '''
+        Returns whether a STATE message is due at the end of a page
+        '''
+        return self.every_page and self.pending > 0
+
+    def emitted(self):
+        '''
+        Records that a STATE message covering every written record was output
+        '''
+        self.pending = 0
+        self.last_emission = time.monotonic()
@@ -0,0 +1,561 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+
+import bisect
+import sys
+import time
+
+from collections import deque
+import requests
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+from tap_typo.logging import log_critical, log_error, log_info
+from tap_typo.pipeline import Prefetcher, prefetch
+from tap_typo.workers import RenderedRecords, render_results_page
+
+
+# Value of the record limit and of the start record id when they are not set
+OPTION_DISABLED = -1
+
+PAGINATION_PAGE = 'page'
+PAGINATION_KEYSET = 'keyset'
+
+DEFAULT_SHARD_BUFFER_PAGES = 10
+
+# Location of the records in a results page, as an ijson prefix
+RESULTS_RECORDS_PREFIX = 'data.records.item'
+# Bytes read at once from a streamed response
+STREAM_CHUNK_SIZE = 64 * 1024
+# Errors reading the body of a streamed response, once its status was received
+STREAM_READ_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError
+)
+
+# Bounds and targets of adaptive page sizes
+DEFAULT_MIN_RECORDS_PER_PAGE = 10
+DEFAULT_MAX_RECORDS_PER_PAGE = 10000
+DEFAULT_TARGET_PAGE_SECONDS = 5
+DEFAULT_MAX_PAGE_BYTES = 16 * 1024 * 1024
+
+
+def has_next_page(headers):
+    '''
+    Whether a results page response links to a next page
+    '''
+    return 'Link' in headers and '; rel="next"' in headers['Link']
+
+
+def iter_json_items(response, prefix):
+    '''
+    Incrementally parses the items found at `prefix` of a streamed JSON response body.
+    The body is read through requests, so read errors are raised as requests exceptions.
+    '''
+    try:
+        items = ijson.sendable_list()
+        parser = ijson.items_coro(items, prefix, use_float=True)
+
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            parser.send(chunk)
+            yield from items
+            del items[:]
+
+        parser.close()
+        yield from items
+    finally:
+        response.close()
+
+
+def count_records(records, page):
+    '''
+    Passes records through, counting them and keeping the id of the last one in `page`.
+    A read error ends the records early and is kept in `page` as its `error`.
+    '''
+    try:
+        for record in records:
+            page['count'] += 1
+            page['last_id'] = record['id']
+            yield record
+    except STREAM_READ_ERRORS as exception:
+        page['error'] = exception
+
+
+def split_id_range(after_id, last_id, shards, min_size=1):
+    '''
+    Splits the record ids after `after_id` up to `last_id` into at most `shards` consecutive ranges
+    of at least `min_size` ids. Returns `(after_id, up_to_id)` pairs in id order. The last range has
+    no upper bound, so ids past `last_id`, an estimate, are still covered.
+    '''
+    id_count = max(0, last_id - after_id)
+    shards = max(1, min(shards, id_count // max(1, min_size)))
+
+    ranges = []
+    for index in range(1, shards):
+        up_to_id = after_id + id_count * index // shards
+        ranges.append((ranges[-1][1] if ranges else after_id, up_to_id))
+
+    ranges.append((ranges[-1][1] if ranges else after_id, None))
+    return ranges
+
+
+class AdaptivePageSize():
+    '''
+    Picks the number of records requested per results page from the latency and payload size
+    of the previous pages.
+
+    Larger pages spread the cost of each round trip over more records, so the page size doubles
+    while full pages take less than half of `target_seconds`. Pages slower than `target_seconds`
+    shrink the next ones proportionally, keeping requests well below the request timeout, and
+    the estimated size in bytes of a page never exceeds `max_page_bytes`.
+    '''
+
+    def __init__(self, initial, minimum=DEFAULT_MIN_RECORDS_PER_PAGE, maximum=DEFAULT_MAX_RECORDS_PER_PAGE,
+                 target_seconds=DEFAULT_TARGET_PAGE_SECONDS, max_page_bytes=DEFAULT_MAX_PAGE_BYTES):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.max_page_bytes = max_page_bytes
+        self.size = self.clamp(initial)
+
+    def clamp(self, size):
+        return max(self.minimum, min(self.maximum, int(size)))
+
+    def page_fetched(self, record_count, seconds, size_bytes=None):
+        '''
+        Adjusts the page size after a page of `record_count` records was fetched in `seconds`.
+        Short pages are the last ones of a stream and say nothing about larger pages.
+        '''
+        if record_count < self.size:
+            return
+
+        size = self.size
+        if seconds > self.target_seconds:
+            size = size * self.target_seconds / seconds
+        elif seconds < self.target_seconds / 2:
+            size = size * 2
+
+        if size_bytes and record_count:
+            size = min(size, self.max_page_bytes * record_count / size_bytes)
+
+        self.size = self.clamp(size)
+
+    def timed_out(self):
+        '''
+        Halves the page size after a request timed out. Returns False when it is already the
+        smallest allowed, so the request should be retried as it is.
+        '''
+        if self.size <= self.minimum:
+            return False
+
+        self.size = self.clamp(self.size // 2)
+        return True
+
+
+class ResultsCursor():
+    '''
+    Tracks where the next results page of a stream starts: its page number or, with keyset
+    pagination, the record id it starts after. Also counts the records fetched so far, to stop
+    at `record_limit` (None for no limit). With an AdaptivePageSize, it sets the page sizes.
+    '''
+
+    def __init__(self, keyset, records_per_page, record_limit=None, start_record_id=None, page_size=None):
+        self.keyset = keyset
+        self.page_size = page_size
+        self.fixed_records_per_page = records_per_page
+        self.record_limit = record_limit
+        self.start_record_id = start_record_id
+        self.page_number = 1
+        self.record_count = 0
+
+    @property
+    def records_per_page(self):
+        return self.page_size.size if self.page_size is not None else self.fixed_records_per_page
+
+    def is_last_page(self, record_count, records_per_page):
+        '''
+        Whether a page is known to be the last one from its number of records
+        '''
+        return self.keyset and record_count < records_per_page
+
+    def resume(self, record_count, last_id):
+        '''
+        Moves past the `record_count` records read from a page that was interrupted, the next
+        page being the first one after `last_id`, or the same page when no record was read.
+        Returns False when no page should be requested after it.
+        '''
+        self.record_count += record_count
+        if self.record_limit is not None and self.record_count >= self.record_limit:
+            return False
+
+        if last_id is not None:
+            self.start_record_id = last_id
+            self.page_number = 1
+
+        return True
+
+    def advance(self, record_count, last_id, records_per_page):
+        '''
+        Moves past a page of `record_count` records that was requested with `records_per_page`.
+        Returns False when no page should be requested after it.
+        '''
+        self.record_count += record_count
+        if self.record_limit is not None and self.record_count >= self.record_limit:
+            return False
+
+        if self.keyset:
+            if self.is_last_page(record_count, records_per_page):
+                return False
+            self.start_record_id = last_id
+        else:
+            self.page_number += 1
+
+        return True
+
+
+class ResultsPager():
+    '''
+    Fetches the results pages of the streams synced by a tap, with the paging settings of its config
+    and through its requests: one page after the other, ahead of the output, rendered by the tap's
+    worker processes, or in record id ranges fetched in parallel.
+    '''
+
+    def __init__(self, tap, config):
+        self.tap = tap
+        self.prefetch_pages = config.get('prefetch_pages', 0)
+        self.stream_records = config.get('stream_records', False)
+        if self.stream_records and ijson is None:
+            log_info('stream_records is enabled but ijson is not installed. Results pages will be parsed whole.')
+            self.stream_records = False
+        self.pagination = config.get('pagination', PAGINATION_PAGE)
+        if self.pagination not in (PAGINATION_PAGE, PAGINATION_KEYSET):
+            log_critical('Invalid pagination `{}`. Valid values are `{}` and `{}`.'.format(
+                self.pagination, PAGINATION_PAGE, PAGINATION_KEYSET))
+            sys.exit(1)
+        # Adaptive page sizes, bounded by the minimum and maximum records per page
+        self.adaptive_page_size = config.get('adaptive_page_size', False)
+        self.min_records_per_page = config.get('min_records_per_page', DEFAULT_MIN_RECORDS_PER_PAGE)
+        self.max_records_per_page = config.get('max_records_per_page', DEFAULT_MAX_RECORDS_PER_PAGE)
+        self.target_page_seconds = config.get('target_page_seconds', DEFAULT_TARGET_PAGE_SECONDS)
+        self.max_page_bytes = config.get('max_page_bytes', DEFAULT_MAX_PAGE_BYTES)
+        if self.adaptive_page_size and self.pagination != PAGINATION_KEYSET:
+            # Page numbers only address the same records while the page size does not change
+            log_info('adaptive_page_size requires keyset pagination. Using keyset pagination.')
+            self.pagination = PAGINATION_KEYSET
+        # Record id ranges of a stream fetched in parallel
+        self.id_range_shards = config.get('id_range_shards', 1)
+        self.shard_buffer_pages = config.get('shard_buffer_pages', DEFAULT_SHARD_BUFFER_PAGES)
+
+    def get_page(self, url, stream=False, retry_timeouts=True, raw=False):
+        '''
+        Fetches one page of results from the Typo API and returns `(data, eof, headers)`. When `stream`
+        is set, the records of the page are a generator parsing them from the response as they are consumed.
+        With `raw`, data is the body of the response, left for a worker process to parse.
+        '''
+        status, headers, data = self.tap.api_get_request(
+            url, stream_prefix=RESULTS_RECORDS_PREFIX if stream else None, retry_timeouts=retry_timeouts, raw=raw)
+
+        # Check Status
+        if status != 200:
+            log_error(data['message'])
+            sys.exit(1)
+
+        if stream:
+            data = {'data': {'records': data}}
+
+        eof = not has_next_page(headers)
+        return data, eof, headers
+
+    def get_page_url(self, stream_sync, page_number, start_record_id, records_per_page):
+        '''
+        Returns the url of a results page of a stream, logging that it is being fetched
+        '''
+        log_info('Fetching page {}{}.'.format(
+            page_number,
+            ' after Typo record id {}'.format(start_record_id) if start_record_id != OPTION_DISABLED else ''))
+
+        if stream_sync.audit_id is not None:
+            base_url = '{}/repositories/{}/datasets/{}/audits/{}/results'.format(
+                self.tap.base_url, stream_sync.repository, stream_sync.dataset, stream_sync.audit_id)
+        else:
+            base_url = '{}/repositories/{}/datasets/{}/results'.format(
+                self.tap.base_url, stream_sync.repository, stream_sync.dataset)
+
+        start_record_id_filter = ''
+
+        if start_record_id != OPTION_DISABLED:
+            start_record_id_filter = '&__typo_id=gt:{}'.format(start_record_id)
+
+        return '{}?records_per_page={}&page={}{}'.format(
+            base_url, records_per_page, page_number, start_record_id_filter)
+
+    def get_stream_pages(self, stream_sync):
+        '''
+        Returns the iterator of `(data, eof)` for every results page of a stream,
+        with its record id ranges fetched in parallel when `id_range_shards` is set
+        '''
+        pages = None
+        if self.id_range_shards > 1:
+            id_ranges = self.get_id_ranges(stream_sync)
+            if len(id_ranges) > 1:
+                pages = self.get_sharded_pages(stream_sync, id_ranges)
+
+        if pages is None:
+            # Pages are fetched in the background, up to `prefetch_pages` ahead of the output.
+            pages = self.get_pages(stream_sync, stream_sync.start_record_id)
+            if self.prefetch_pages > 0:
+                pages = prefetch(pages, self.prefetch_pages)
+
+        return pages
+
+    def get_render_options(self, stream_sync):
+        '''
+        Returns the render options of a stream when its pages are rendered by worker processes, None otherwise
+        '''
+        return stream_sync.render_options if self.tap.render_pool is not None else None
+
+    def get_pages(self, stream_sync, start_record_id, prefetched=None, render_ahead=True):
+        '''
+        Yields `(data, eof)` for every results page of a stream after `start_record_id`, in order,
+        stopping after the last page or once enough records were fetched to reach the record limit.
+
+        With `keyset` pagination every request asks for the first page of the records after the
+        last record id seen, so the server never skips over previous pages. Paging stops when a
+        page comes back short or has no next link.
+
+        With `stream_records`, records are parsed while the caller consumes them, so the page's
+        records must be consumed before asking for the next page. Prefetched pages are parsed whole,
+        pages are prefetched when `prefetched` is set and, by default, when `prefetch_pages` is.
+
+        A streamed page interrupted by a read error is resumed with the first page of the records
+        after the last one consumed, as often as the retry policy allows.
+
+        When the tap has worker processes, the body of each page is sent as it is to one of them,
+        which parses, transforms and renders its records into RECORD messages. With page numbers,
+        several pages are rendered at once, see `get_rendered_pages`. With keyset pagination, pages
+        are yielded once rendered, as the next page to fetch depends on their records.
+
+        With `adaptive_page_size`, the size of each page depends on how long the previous ones took.
+        A timed out request is first retried with a smaller page, then with the usual backoff.
+
+        Paging stops early once the tap's `sync_stopped` is set.
+        '''
+        tap = self.tap
+        eof = False
+        read_errors = 0
+        if prefetched is None:
+            prefetched = self.prefetch_pages > 0
+        render_options = self.get_render_options(stream_sync)
+        render = render_options is not None
+        stream = self.stream_records and not prefetched and not render
+        cursor = self.create_cursor(start_record_id)
+        page_size = cursor.page_size
+
+        if render and not cursor.keyset:
+            yield from self.get_rendered_pages(stream_sync, cursor, render_options, render_ahead)
+            return
+
+        while not eof and not tap.sync_stopped.is_set():
+            records_per_page = cursor.records_per_page
+
+            started = time.monotonic()
+            try:
+                data, eof, headers = self.get_page(
+                    self.get_page_url(stream_sync, cursor.page_number, cursor.start_record_id, records_per_page),
+                    stream, retry_timeouts=page_size is None or page_size.size <= page_size.minimum, raw=render)
+            except requests.exceptions.Timeout:
+                # NOTE: Only raised while the page size can still shrink
+                page_size.timed_out()
+                log_info('Page request timed out. Retrying with {} records per page.'.format(page_size.size))
+                continue
+            seconds = time.monotonic() - started
+
+            page = {'count': 0, 'last_id': None, 'error': None}
+
+            if stream:
+                data['data']['records'] = count_records(data['data']['records'], page)
+            else:
+                if render:
+                    records = tap.render_pool.submit(render_results_page, render_options, data).result()
+                    data = {'data': {'records': records}}
+                    record_ids = records.record_ids
+                    page['count'] = len(record_ids)
+                    page['last_id'] = record_ids[-1] if record_ids else None
+                else:
+                    records = data['data']['records']
+                    page['count'] = len(records)
+                    page['last_id'] = records[-1]['id'] if records else None
+
+                if cursor.is_last_page(page['count'], records_per_page):
+                    eof = True
+
+            yield data, eof
+
+            error = page['error']
+            if error is not None:
+                read_errors += 1
+                if read_errors > tap.retry_policy.max_retries:
+                    raise error
+
+                delay = tap.retry_policy.get_delay(read_errors)
+                tap.retry_policy.record('read')
+                log_info('Results page interrupted after {} records. Sleeping {:.1f} seconds before resuming: {}'
+                         .format(page['count'], delay, error))
+                time.sleep(delay)
+
+                eof = False
+                if not cursor.resume(page['count'], page['last_id']):
+                    return
+                continue
+            read_errors = 0
+
+            if page_size is not None:
+                # Streamed pages are only counted once consumed
+                content_length = headers.get('Content-Length')
+                page_size.page_fetched(page['count'], seconds, int(content_length) if content_length else None)
+
+            # A short streamed page is only known once consumed
+            if not cursor.advance(page['count'], page['last_id'], records_per_page):
+                return
+
+    def get_rendered_pages(self, stream_sync, cursor, render_options, render_ahead=True):
+        '''
+        Yields `(data, eof)` for the page numbered results pages of a stream, rendered by the worker
+        processes. The next page only needs its number, so with `render_ahead` up to `transform_processes`
+        pages are fetched and rendered at once, and yielded in order. Pages in flight are counted as full
+        pages, so no page past the record limit is fetched.
+        '''
+        records_per_page = cursor.records_per_page
+        window = self.tap.transform_processes if render_ahead else 1
+        rendering = deque()
+        eof = False
+
+        try:
+            while not self.tap.sync_stopped.is_set():
+                while not eof and len(rendering) < window and (
+                        cursor.record_limit is None
+                        or cursor.record_count + len(rendering) * records_per_page < cursor.record_limit):
+                    data, eof, _ = self.get_page(self.get_page_url(
+                        stream_sync, cursor.page_number + len(rendering), cursor.start_record_id, records_per_page),
+                        raw=True)
+                    rendering.append((self.tap.render_pool.submit(render_results_page, render_options, data), eof))
+
+                if not rendering:
+                    return
+
+                future, page_eof = rendering.popleft()
+                records = future.result()
+                record_ids = records.record_ids
+                yield {'data': {'records': records}}, page_eof
+
+                if not cursor.advance(len(record_ids), record_ids[-1] if record_ids else None, records_per_page):
+                    return
+        finally:
+            for future, _ in rendering:
+                future.cancel()
+
+    def create_cursor(self, start_record_id):
+        '''
+        Returns the cursor of a stream's results pages, starting after `start_record_id`
+        '''
+        tap = self.tap
+        page_size = None
+        if self.adaptive_page_size:
+            page_size = AdaptivePageSize(
+                tap.records_per_page, self.min_records_per_page, self.max_records_per_page,
+                self.target_page_seconds, self.max_page_bytes)
+
+        return ResultsCursor(
+            self.pagination == PAGINATION_KEYSET, tap.records_per_page,
+            tap.record_limit if tap.record_limit != OPTION_DISABLED else None, start_record_id, page_size)
+
+    def get_id_ranges(self, stream_sync):
+        '''
+        Splits the record ids of a stream after its start into up to `id_range_shards` ranges of
+        at least a page each. Record ids are assumed to go up to the number of records of the
+        stream, from the catalog or from a one record page. The last range has no upper bound,
+        so a wrong estimate only makes ranges uneven.
+        '''
+        tap = self.tap
+        start_record_id = stream_sync.start_record_id
+        if start_record_id != OPTION_DISABLED and not isinstance(start_record_id, int):
+            return [(start_record_id, None)]
+
+        last_id = tap.catalog_index.get_stream_metadata(stream_sync.stream_id, 'row-count')
+        if last_id is None:
+            data, _, _ = self.get_page(self.get_page_url(stream_sync, 1, OPTION_DISABLED, 1))
+            last_id = data['data'].get('total_records')
+            if last_id is None:
+                return [(start_record_id, None)]
+
+        id_ranges = split_id_range(
+            max(start_record_id, 0), last_id, self.id_range_shards, tap.records_per_page)
+        # Without a bookmark, the first range starts with the first record
+        id_ranges[0] = (start_record_id, id_ranges[0][1])
+
+        log_info('Fetching stream `{}` in {} Typo record id ranges.'.format(stream_sync.stream_id, len(id_ranges)))
+        return id_ranges
+
+    def get_range_pages(self, stream_sync, after_id, up_to_id):
+        '''
+        Yields `(data, eof)` for the results pages of the records with ids after `after_id`
+        and up to `up_to_id`, or to the last record when `up_to_id` is None
+        '''
+        # Ranges are already rendered at once, and rendering ahead would fetch pages past their end
+        pages = self.get_pages(stream_sync, after_id, prefetched=True, render_ahead=False)
+
+        for data, eof in pages:
+            records = data['data']['records']
+            if isinstance(records, RenderedRecords):
+                record_ids = records.record_ids
+            else:
+                record_ids = [record['id'] for record in records]
+
+            if up_to_id is not None and record_ids and record_ids[-1] > up_to_id:
+                # The range ends within this page, the next range starts with the records left out
+                kept = bisect.bisect_right(record_ids, up_to_id)
+                if isinstance(records, RenderedRecords):
+                    data['data']['records'] = RenderedRecords(record_ids[:kept], records.lines[:kept])
+                else:
+                    data['data']['records'] = records[:kept]
+                yield data, True
+                return
+
+            yield data, eof
+
+    def get_sharded_pages(self, stream_sync, id_ranges):
+        '''
+        Yields `(data, eof)` for every results page of a stream, fetching each record id range from its
+        own thread, up to `shard_buffer_pages` pages ahead. Ranges are yielded one after the other,
+        so records keep their id order and the stream's bookmark only moves forward.
+        '''
+        shards = [
+            Prefetcher(self.get_range_pages(stream_sync, after_id, up_to_id), self.shard_buffer_pages)
+            for after_id, up_to_id in id_ranges
+        ]
+
+        try:
+            for index, shard in enumerate(shards):
+                is_last_shard = index == len(shards) - 1
+                for data, eof in shard:
+                    yield data, eof and is_last_shard
+        finally:
+            for shard in shards:
+                shard.close()
@@ -0,0 +1,95 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+
+import queue
+import threading
+
+
+_ITEM = 'item'
+_DONE = 'done'
+_ERROR = 'error'
+
+# Seconds between checks for a cancelled consumer while the buffer is full
+_PUT_TIMEOUT = 0.1
+
+
+def _put(items, entry, stop):
+    '''
+    Puts an entry in the buffer, giving up if the consumer went away
+    '''
+    while not stop.is_set():
+        try:
+            items.put(entry, timeout=_PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+class Prefetcher():
+    '''
+    Iterates `iterable` from a background thread started right away, staying up to `depth` items
+    ahead of the consumer. Items are yielded in their original order and any exception raised
+    while producing them (including SystemExit) is re-raised in the consumer. `close` stops the
+    producer, whether or not the items were consumed.
+    '''
+
+    def __init__(self, iterable, depth):
+        self.items = queue.Queue(maxsize=depth)
+        self.stop = threading.Event()
+        self.producer = threading.Thread(
+            target=self.produce, args=(iterable,), name='tap-typo-prefetch', daemon=True)
+        self.producer.start()
+
+    def produce(self, iterable):
+        '''
+        Fills the buffer, runs in the producer thread
+        '''
+        try:
+            for item in iterable:
+                if not _put(self.items, (_ITEM, item), self.stop):
+                    return
+            _put(self.items, (_DONE, None), self.stop)
+        except BaseException as exception:  # pylint: disable=broad-except
+            _put(self.items, (_ERROR, exception), self.stop)
+
+    def __iter__(self):
+        while True:
+            kind, value = self.items.get()
+            if kind == _DONE:
+                return
+            if kind == _ERROR:
+                raise value
+            yield value
+
+    def close(self):
+        '''
+        Stops the producer
+        '''
+        self.stop.set()
+
+
+def prefetch(iterable, depth):
+    '''
+    Iterates `iterable` from a background thread, staying up to `depth` items ahead of the consumer.
+    Items are yielded in their original order and any exception raised while producing them
+    (including SystemExit) is re-raised in the consumer.
+    '''
+    prefetcher = Prefetcher(iterable, depth)
+    try:
+        yield from prefetcher
+    finally:
+        prefetcher.close()
@@ -0,0 +1,154 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+
+from email.utils import parsedate_to_datetime
+import threading
+import time
+
+
+# Rate limit reset values above this are UNIX timestamps rather than a number of seconds
+RESET_TIMESTAMP_THRESHOLD = 1000000000
+
+
+def parse_seconds(value):
+    '''
+    Parses a header value holding a number of seconds, None when it does not
+    '''
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_retry_after(headers):
+    '''
+    Returns the seconds to wait from a Retry-After header, given as seconds or as an HTTP date
+    '''
+    value = headers.get('Retry-After')
+    if value is None:
+        return None
+
+    seconds = parse_seconds(value)
+    if seconds is not None:
+        return max(0, seconds)
+
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def get_rate_limit_reset(headers):
+    '''
+    Returns the seconds until the rate limit window resets when its remaining requests are
+    exhausted, from the `RateLimit-*` or `X-RateLimit-*` headers. None otherwise.
+    '''
+    for prefix in ('RateLimit-', 'X-RateLimit-'):
+        remaining = parse_seconds(headers.get(prefix + 'Remaining'))
+        if remaining is None or remaining > 0:
+            continue
+
+        reset = parse_seconds(headers.get(prefix + 'Reset'))
+        if reset is None:
+            return None
+        if reset > RESET_TIMESTAMP_THRESHOLD:
+            reset -= time.time()
+        return max(0, reset)
+
+    return None
+
+
+class RateLimiter():
+    '''
+    Limits the requests made to Typo by every thread of the tap.
+
+    Requests are started at most `rate` times per second on average, with bursts of up to
+    `burst` requests (token bucket), and at most `max_concurrency` of them are in flight at once.
+    Either limit is disabled when not set. Every request also waits while the server asked to
+    pause, through a Retry-After header or exhausted rate limit headers.
+
+    Used as a context manager around sending a request.
+    '''
+
+    def __init__(self, rate=None, burst=None, max_concurrency=None):
+        self.rate = rate or None
+        self.burst = burst or max(1, rate or 1)
+        self.semaphore = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.lock = threading.Lock()
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.paused_until = 0
+
+    def __enter__(self):
+        if self.semaphore is not None:
+            self.semaphore.acquire()
+        try:
+            self.wait()
+        except BaseException:
+            self.__exit__()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.semaphore is not None:
+            self.semaphore.release()
+
+    def wait(self):
+        '''
+        Waits until a request can be started
+        '''
+        while True:
+            delay = self.reserve()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def reserve(self):
+        '''
+        Takes the right to start a request without waiting. Returns 0 when it was taken,
+        otherwise the number of seconds to wait before trying again.
+        '''
+        with self.lock:
+            now = time.monotonic()
+            delay = self.paused_until - now
+            if delay > 0:
+                return delay
+
+            if self.rate is None:
+                return 0
+
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+
+            return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds):
+        '''
+        Holds every request for `seconds`
+        '''
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def update(self, headers):
+        '''
+        Pauses requests until the rate limit resets when a response says none are remaining
+        '''
+        reset = get_rate_limit_reset(headers)
+        if reset:
+            self.pause(reset)
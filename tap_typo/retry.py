@@ -0,0 +1,79 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+
+from collections import Counter
+import random
+import threading
+import time
+
+
+# Statuses of transient failures: rate limiting and server errors
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_BASE_DELAY = 1
+DEFAULT_RETRY_MAX_DELAY = 60
+DEFAULT_RETRY_DEADLINE = 300
+
+
+class RetryPolicy():
+    '''
+    Decides which failed requests are sent again and when.
+
+    Responses with a status in RETRYABLE_STATUSES are retried up to `max_retries` times, as long
+    as the request has not been going on for more than `deadline` seconds once the next delay is
+    waited. Delays follow the server's Retry-After when given, otherwise a random delay up to an
+    exponentially growing bound (full jitter) so concurrent requests do not retry in lockstep.
+    Other statuses, like the remaining 4xx, are not retried.
+
+    The number of retries per reason is kept in `counts`.
+    '''
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_RETRY_BASE_DELAY,
+                 max_delay=DEFAULT_RETRY_MAX_DELAY, deadline=DEFAULT_RETRY_DEADLINE):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    # pylint: disable=no-self-use
+    def is_retryable(self, status):
+        return status in RETRYABLE_STATUSES
+
+    def get_delay(self, attempt, retry_after=None):
+        '''
+        Returns the seconds to wait before the `attempt`th retry
+        '''
+        if retry_after is not None:
+            return retry_after
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def should_retry(self, attempt, started_at, delay):
+        '''
+        Whether the `attempt`th retry of a request started at `started_at` (time.monotonic())
+        fits in the retry and deadline budgets
+        '''
+        return attempt <= self.max_retries and time.monotonic() - started_at + delay <= self.deadline
+
+    def record(self, reason):
+        '''
+        Counts a retry
+        '''
+        with self.lock:
+            self.counts[reason] += 1
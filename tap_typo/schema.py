@@ -0,0 +1,145 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+
+import pickle
+
+from tap_typo.transform import TYPO_RECORD_ID_PROPERTY, TYPO_RESULT_PROPERTY
+
+
+# JSON schema type of each Typo field type. Unknown types are output as strings.
+FIELD_TYPES = {
+    'float': 'number',
+    'number': 'number',
+    'integer': 'integer',
+    'int': 'integer',
+    'smallint': 'integer',
+    'varchar': 'string',
+    'string': 'string',
+    'date-time': 'string'
+}
+DEFAULT_FIELD_TYPE = 'string'
+
+# SQL datatype of each JSON schema type
+SQL_TYPES = {
+    'number': 'float',
+    'integer': 'int',
+    'string': 'varchar(255)',
+    'date-time': 'datetime',
+    'boolean': 'bool'
+}
+DEFAULT_SQL_TYPE = 'varchar(255)'
+
+# Properties added by Typo to every record: (JSON schema, SQL datatype)
+TYPO_PROPERTIES = {
+    TYPO_RESULT_PROPERTY: ({'type': 'string'}, 'varchar(255)'),
+    TYPO_RECORD_ID_PROPERTY: ({'type': 'integer'}, 'int')
+}
+
+
+def compile_schema(typo_schema, output_rfc3339_datetime=False):
+    '''
+    Converts a Typo schema into (key_properties, schema, sql_types, datetime_formats, field_metadata),
+    where `field_metadata` are the catalog metadata entries of the schema properties.
+    '''
+    schema_properties = {}
+    key_properties = [TYPO_RECORD_ID_PROPERTY]
+    sql_types = {}
+    datetime_formats = {}
+
+    for field, spec in (typo_schema or {}).items():
+        if spec.get('primary'):
+            key_properties.append(field)
+
+        # Only add spec for fields we can identify with certainty
+        if 'type' not in spec:
+            schema_properties[field] = {}
+            continue
+
+        field_type = FIELD_TYPES.get(spec['type'], DEFAULT_FIELD_TYPE)
+        field_schema = {'type': ['null', field_type]}
+
+        if spec['type'] == 'date-time' and spec.get('format') is not None and output_rfc3339_datetime:
+            field_schema['format'] = 'date-time'
+            datetime_formats[field] = spec['format']
+
+        schema_properties[field] = field_schema
+        sql_types[field] = SQL_TYPES.get(field_type, DEFAULT_SQL_TYPE)
+
+    for field, (field_schema, sql_type) in TYPO_PROPERTIES.items():
+        schema_properties[field] = dict(field_schema)
+        sql_types[field] = sql_type
+
+    schema = {
+        'type': 'object',
+        'additionalProperties': True,
+        'properties': schema_properties
+    }
+
+    field_metadata = []
+    for field in schema_properties:
+        metadata = {
+            'inclusion': 'automatic' if field in key_properties or field in TYPO_PROPERTIES else 'available',
+            'selected-by-default': True  # Fields are selected by default.
+        }
+        # NOTE: Fields without a type have no SQL datatype
+        if field in sql_types:
+            metadata['sql-datatype'] = sql_types[field]
+        if field in datetime_formats:
+            metadata['datetime-format'] = datetime_formats[field]
+        field_metadata.append({'breadcrumb': ('properties', field), 'metadata': metadata})
+
+    return key_properties, schema, sql_types, datetime_formats, field_metadata
+
+
+def get_schema_key(typo_schema):
+    '''
+    Returns a key identifying a Typo schema by its content, including the field order
+    which is the order of the output properties.
+
+    Pickling is several times faster than JSON serialization. Equal schemas sharing their
+    objects differently could get different keys, which only costs an extra compilation.
+    '''
+    return pickle.dumps(typo_schema, pickle.HIGHEST_PROTOCOL)
+
+
+class SchemaCompiler:  # pylint: disable=too-few-public-methods
+    '''
+    Compiles Typo schemas, computing each distinct schema only once.
+
+    Audits of a dataset usually share its schema, so results are remembered by the schema
+    content. Every call returns its own key properties, schema properties and field metadata
+    lists so fields can be added to or removed from a catalog entry independently. Their items
+    are shared between entries and must be replaced rather than modified.
+    '''
+
+    def __init__(self, output_rfc3339_datetime=False):
+        self.output_rfc3339_datetime = output_rfc3339_datetime
+        self.compiled = {}
+
+    def compile(self, typo_schema):
+        key = get_schema_key(typo_schema)
+
+        compiled = self.compiled.get(key)
+        if compiled is None:
+            compiled = compile_schema(typo_schema, self.output_rfc3339_datetime)
+            self.compiled[key] = compiled
+
+        key_properties, schema, sql_types, datetime_formats, field_metadata = compiled
+
+        return (
+            list(key_properties), dict(schema, properties=dict(schema['properties'])),
+            sql_types, datetime_formats, list(field_metadata)
+        )
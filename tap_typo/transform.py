@@ -0,0 +1,204 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+
+from datetime import datetime
+from functools import lru_cache
+
+from rfc3339 import rfc3339
+
+
+TYPO_RECORD_ID_PROPERTY = '__typo_record_id'
+TYPO_RESULT_PROPERTY = '__typo_result'
+
+# Number of distinct raw values remembered per datetime format
+DEFAULT_DATETIME_CACHE_SIZE = 4096
+
+# strptime directives that always match a fixed number of digits: (width, datetime argument)
+FIXED_WIDTH_DIRECTIVES = {
+    '%Y': (4, 'year'),
+    '%m': (2, 'month'),
+    '%d': (2, 'day'),
+    '%H': (2, 'hour'),
+    '%M': (2, 'minute'),
+    '%S': (2, 'second')
+}
+
+# Values used by strptime for the parts missing from a format
+STRPTIME_DEFAULTS = {'year': 1900, 'month': 1, 'day': 1}
+
+
+def compile_datetime_parser(datetime_format):
+    '''
+    Returns a function parsing strings in `datetime_format` into datetimes, as `datetime.strptime` does.
+
+    When the format only has fixed width numeric directives and literal characters, values with
+    the exact expected layout are parsed by slicing. Anything else, including values the fast
+    path rejects, goes through `datetime.strptime` so results and errors are the same.
+    '''
+    def parse_strptime(value):
+        return datetime.strptime(value, datetime_format)
+
+    fields = []
+    literals = []
+    position = 0
+    index = 0
+
+    while index < len(datetime_format):
+        if datetime_format[index] == '%':
+            directive = datetime_format[index:index + 2]
+            if directive == '%%':
+                literals.append((position, '%'))
+                position += 1
+            elif directive in FIXED_WIDTH_DIRECTIVES:
+                width, argument = FIXED_WIDTH_DIRECTIVES[directive]
+                fields.append((argument, position, position + width))
+                position += width
+            else:
+                return parse_strptime
+            index += 2
+        else:
+            literals.append((position, datetime_format[index]))
+            position += 1
+            index += 1
+
+    # strptime refuses repeated directives
+    if len({argument for argument, _, _ in fields}) != len(fields):
+        return parse_strptime
+
+    length = position
+
+    def parse_fixed_width(value):
+        if not isinstance(value, str) or len(value) != length:
+            return parse_strptime(value)
+
+        for literal_position, literal in literals:
+            if value[literal_position] != literal:
+                return parse_strptime(value)
+
+        arguments = dict(STRPTIME_DEFAULTS)
+        try:
+            for argument, start, end in fields:
+                digits = value[start:end]
+                if not digits.isdigit():
+                    return parse_strptime(value)
+                arguments[argument] = int(digits)
+
+            return datetime(**arguments)
+        except ValueError:
+            return parse_strptime(value)
+
+    return parse_fixed_width
+
+
+def compile_rfc3339_converter(datetime_format, cache_size=DEFAULT_DATETIME_CACHE_SIZE):
+    '''
+    Returns a function converting strings in `datetime_format` into RFC 3339 strings.
+    The results of the last `cache_size` distinct values are remembered.
+    '''
+    parse = compile_datetime_parser(datetime_format)
+
+    @lru_cache(maxsize=cache_size)
+    def convert(value):
+        return rfc3339(parse(value))
+
+    return convert
+
+
+class DatetimeConverter():
+    '''
+    Converts the datetime fields of a stream's records into RFC 3339 strings.
+    Built once per stream from the field name to datetime format mapping found in its metadata.
+    '''
+
+    def __init__(self, fields_format, cache_size=DEFAULT_DATETIME_CACHE_SIZE):
+        # Fields sharing a format share a converter and its cache
+        converters = {}
+        self.fields = []
+
+        for field_name, datetime_format in fields_format.items():
+            if datetime_format not in converters:
+                converters[datetime_format] = compile_rfc3339_converter(datetime_format, cache_size)
+            self.fields.append((field_name, converters[datetime_format]))
+
+    def convert_record(self, record_data):
+        '''
+        Converts the datetime fields of one record in place
+        '''
+        for field_name, convert in self.fields:
+            record_data[field_name] = convert(record_data[field_name])
+
+    def convert_records(self, records_data):
+        '''
+        Converts the datetime fields of a list of records in place, one column at a time.
+        Each distinct value of a column is converted once.
+        '''
+        for field_name, convert in self.fields:
+            column = [record_data[field_name] for record_data in records_data]
+            converted = {value: convert(value) for value in set(column)}
+
+            for record_data, value in zip(records_data, column):
+                record_data[field_name] = converted[value]
+
+
+class RecordTransformer():  # pylint: disable=too-few-public-methods
+    '''
+    Turns Typo results records into the records output for a stream: adds the Typo properties,
+    removes `excluded_fields` and converts datetime fields.
+    Compiled once per stream, so nothing that only depends on the stream is decided per record.
+    '''
+    __slots__ = ('transform_record', 'transform_page')
+
+    def __init__(self, datetime_converter=None, excluded_fields=()):
+        excluded_fields = tuple(excluded_fields)
+
+        def add_typo_properties(record):
+            record_data = record['record']
+            record_data[TYPO_RESULT_PROPERTY] = 'Error' if record['has_errors'] else 'OK'
+            record_data[TYPO_RECORD_ID_PROPERTY] = record['id']
+            return record_data
+
+        if excluded_fields:
+            def project(record):
+                record_data = add_typo_properties(record)
+                for field_name in excluded_fields:
+                    record_data.pop(field_name, None)
+                return record_data
+        else:
+            project = add_typo_properties
+
+        if datetime_converter is None:
+            def transform_page(records):
+                return [project(record) for record in records]
+
+            self.transform_record = project
+            self.transform_page = transform_page
+            return
+
+        convert_record = datetime_converter.convert_record
+        convert_records = datetime_converter.convert_records
+
+        def transform_record(record):
+            record_data = project(record)
+            convert_record(record_data)
+            return record_data
+
+        def transform_converted_page(records):
+            records_data = [project(record) for record in records]
+            convert_records(records_data)
+            return records_data
+
+        self.transform_record = transform_record
+        self.transform_page = transform_converted_page
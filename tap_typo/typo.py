@@ -16,33 +16,57 @@
 
 import json
 import sys
+import threading
+import time
 
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 import backoff
 import singer
-from rfc3339 import rfc3339
 
+from tap_typo.aio import AsyncEngine, aiohttp
+from tap_typo.auth import DEFAULT_TOKEN_REFRESH_MARGIN, TokenManager
+from tap_typo.cache import DEFAULT_DISCOVERY_CACHE_TTL, DiscoveryCache, TokenCache
+from tap_typo.catalog import CatalogIndex, carry_over_selection, get_stream_names, get_tap_stream_id, has_results
+from tap_typo.checkpoint import DEFAULT_CHECKPOINT_EVERY_SECONDS, Checkpoint, load_checkpoint, merge_bookmarks
 from tap_typo.logging import log_backoff, log_critical, log_error, log_info
+from tap_typo.output import DEFAULT_BUFFER_SIZE, MessageWriter, QueuedMessageWriter, StateEmissionPolicy
+from tap_typo.paging import OPTION_DISABLED, ResultsPager, iter_json_items
+from tap_typo.ratelimit import RateLimiter, get_rate_limit_reset, get_retry_after
+from tap_typo.retry import (
+    DEFAULT_MAX_RETRIES, DEFAULT_RETRY_BASE_DELAY, DEFAULT_RETRY_DEADLINE, DEFAULT_RETRY_MAX_DELAY, RetryPolicy
+)
+from tap_typo.schema import SchemaCompiler
+from tap_typo.transform import (
+    DEFAULT_DATETIME_CACHE_SIZE, TYPO_RECORD_ID_PROPERTY, DatetimeConverter, RecordTransformer
+)
+from tap_typo.workers import RenderedRecords, create_render_pool, get_render_options
 
 
 GOOD_STATUS = [200, 201, 202]
-OPTION_DISABLED = -1
+NOT_MODIFIED_STATUS = 304
+UNAUTHORIZED_STATUS = 401
+TOO_MANY_REQUESTS_STATUS = 429
+
+ENGINE_THREADS = 'threads'
+ENGINE_ASYNC = 'async'
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
 
-TYPO_RECORD_ID_PROPERTY = '__typo_record_id'
-TYPO_RESULT_PROPERTY = '__typo_result'
 BOOKMARK_PROPERTIES = [TYPO_RECORD_ID_PROPERTY]
 
 
-def get_tap_stream_id(repository, dataset, audit_id):
+def backoff_retry(details):
     '''
-    Generates a stream ID from a Dataset name & Audit ID
+    Called before backoff retries a request that failed with a network error
     '''
-    stream_id = f'tap-typo-{repository}-{dataset}'
-    if audit_id:
-        return f'{stream_id}-audit-{audit_id}'
+    (_, exception, _) = sys.exc_info()
 
-    return stream_id
+    tap = details['args'][0]
+    tap.retry_policy.record('timeout' if isinstance(exception, requests.exceptions.Timeout) else 'connection')
+    log_backoff(details)
 
 
 # pylint: disable=unused-argument
@@ -54,16 +78,45 @@ def backoff_giveup(exception):
     sys.exit(1)
 
 
-class TapTypo():
+def get_error_data(response):
+    '''
+    Returns the JSON data of a failed response, or None when its body is not JSON,
+    as with the HTML error pages of gateways
+    '''
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+
+class StreamSync():  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    '''
+    A stream being synced: where its results are, the bookmark it starts after,
+    how its records are transformed and when its STATE messages are emitted
+    '''
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, stream_id, repository, dataset, audit_id, start_record_id, transformer, state_policy, render_options):
+        self.stream_id = stream_id
+        self.repository = repository
+        self.dataset = dataset
+        self.audit_id = audit_id
+        self.start_record_id = start_record_id
+        self.transformer = transformer
+        self.state_policy = state_policy
+        self.render_options = render_options
+        self.record_count = 0
+
+
+class TapTypo():  # pylint: disable=too-many-public-methods
     '''
     Handles fetching streaming or audit dataset data from Typo
     and outputting to stdout following Singer tap standard.
     '''
 
-    def __init__(self, config, state=None, catalog=None):
+    def __init__(self, config, state=None, catalog=None, lazy_catalog=False, resume_from_checkpoint=None):
         self.config = config.copy()
         self.state = state.copy() if state else {}
-        self.token = None
 
         self.base_url = config['cluster_api_endpoint']
         self.api_key = config['api_key']
@@ -72,51 +125,183 @@ class TapTypo():
         self.dataset = config.get('dataset')
         # audit_id is optional
         self.audit_id = config.get('audit_id')
-        self.start_record_id = OPTION_DISABLED
         self.records_per_page = config['records_per_page'] if 'records_per_page' in config else 100
         self.record_limit = config['record_limit'] if 'record_limit' in config else OPTION_DISABLED
         self.output_rfc3339_datetime = config.get('output_rfc3339_datetime', False)
-
-        # Stream properties
-        self.key_properties = None
-        self.schema = None
-        self.stream_id = None
+        self.datetime_cache_size = config.get('datetime_cache_size', DEFAULT_DATETIME_CACHE_SIZE)
+        self.schema_compiler = SchemaCompiler(self.output_rfc3339_datetime)
+        # Results pages, fetched with the paging settings of the config
+        self.pager = ResultsPager(self, config)
+        self.max_parallel_streams = config.get('max_parallel_streams', 1)
+        self.engine = config.get('engine', ENGINE_THREADS)
+        if self.engine not in (ENGINE_THREADS, ENGINE_ASYNC):
+            log_critical('Invalid engine `{}`. Valid values are `{}` and `{}`.'.format(
+                self.engine, ENGINE_THREADS, ENGINE_ASYNC))
+            sys.exit(1)
+        if self.engine == ENGINE_ASYNC and aiohttp is None:
+            log_info('The async engine is selected but aiohttp is not installed. Using the threads engine.')
+            self.engine = ENGINE_THREADS
+
+        # STATE emission policy, by default one STATE message per record. Triggers are combined,
+        # so configuring another one turns the per record trigger off unless it is also set.
+        self.state_every_seconds = config.get('state_every_seconds', 0)
+        self.state_every_page = config.get('state_every_page', False)
+        self.state_every_records = config.get(
+            'state_every_records', 0 if self.state_every_seconds or self.state_every_page else 1)
+
+        # HTTP connection pool
+        self.pool_connections = config.get('pool_connections', DEFAULT_POOL_CONNECTIONS)
+        self.pool_maxsize = config.get(
+            'pool_maxsize', max(DEFAULT_POOL_MAXSIZE, self.max_parallel_streams * self.pager.id_range_shards))
+        self.pool_block = config.get('pool_block', False)
+        self.session = self.create_session()
+
+        # Rate limits shared by every request
+        self.max_concurrent_requests = config.get('max_concurrent_requests')
+        self.rate_limiter = RateLimiter(
+            config.get('max_requests_per_second'), config.get('max_requests_burst'), self.max_concurrent_requests)
+
+        # Retries of rate limited requests and server errors
+        self.retry_policy = RetryPolicy(
+            config.get('max_retries', DEFAULT_MAX_RETRIES),
+            config.get('retry_base_delay', DEFAULT_RETRY_BASE_DELAY),
+            config.get('retry_max_delay', DEFAULT_RETRY_MAX_DELAY),
+            config.get('retry_deadline', DEFAULT_RETRY_DEADLINE))
+
+        # Access token, shared by every request and optionally reused across runs
+        token_cache = None
+        if config.get('token_cache_dir'):
+            token_cache = TokenCache(config['token_cache_dir'], self.base_url, self.api_key)
+        self.token_manager = TokenManager(
+            self.request_token, config.get('token_refresh_margin', DEFAULT_TOKEN_REFRESH_MARGIN), token_cache)
+
+        # Output
+        self.fast_json = config.get('fast_json', False)
+        # Worker processes transforming and rendering records, started when syncing
+        self.transform_processes = config.get('transform_processes', 0)
+        self.render_pool = None
+        self.checkpoint = None
+        if config.get('checkpoint_file'):
+            self.checkpoint = Checkpoint(
+                config['checkpoint_file'], config.get('checkpoint_every_seconds', DEFAULT_CHECKPOINT_EVERY_SECONDS))
+        self.output = MessageWriter(
+            config.get('output_buffer_size', DEFAULT_BUFFER_SIZE), self.fast_json, self.checkpoint)
+
+        if resume_from_checkpoint is None:
+            resume_from_checkpoint = config.get('resume_from_checkpoint', False)
+        if resume_from_checkpoint:
+            self.resume_from_checkpoint(
+                resume_from_checkpoint if isinstance(resume_from_checkpoint, str) else config.get('checkpoint_file'))
+        self.state_lock = threading.Lock()
+        # Set once a stream synced in parallel fails, for the others to stop early
+        self.sync_stopped = threading.Event()
+
+        # Discovery
+        self.discovered_catalog = None
+        # A provided catalog is the starting point of an incremental discovery
+        self.previous_catalog = catalog if config.get('incremental_discovery') else None
+        self.discovery_cache = None
+        if config.get('discovery_cache_dir'):
+            self.discovery_cache = DiscoveryCache(
+                config['discovery_cache_dir'], self.base_url, self.api_key, self.repository,
+                config.get('discovery_cache_ttl', DEFAULT_DISCOVERY_CACHE_TTL))
 
         if catalog:
             log_info('Loading catalog from provided file')
             self.catalog = catalog
+        elif lazy_catalog and self.repository and self.dataset:
+            # Only the configured stream will be synced, there is no need to discover the others
+            log_info('Building catalog for the configured stream')
+            entry = self.get_configured_catalog_entry()
+            self.catalog = {
+                'streams': [entry] if entry is not None else []
+            }
         else:
             log_info('Discovering catalog')
             self.catalog = self.get_catalog()
 
-    def fetch_audits(self):
+        self.catalog_index = CatalogIndex(self.catalog)
+
+    def create_session(self):
         '''
-        Requests Typo for the list of available Dataset's
+        Creates the HTTP session shared by every request made to the Typo API.
+        Connections are kept alive and reused from a pool with at most `pool_maxsize`
+        connections per host.
+        '''
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def get_listing(self, url):
         '''
+        Requests one of the discovery listings, going through the discovery cache when enabled.
+        Fresh cached listings are used without a request, stale ones are revalidated.
+        '''
+        if self.discovery_cache is None:
+            return self.api_get_request(url)
+
+        entry = self.discovery_cache.get(url)
+        if entry and self.discovery_cache.is_fresh(entry):
+            return 200, {'Link': entry.get('link') or ''}, entry['data']
+
+        validators = self.discovery_cache.get_validators(entry) if entry else None
+        status, headers, data = self.api_get_request(url, headers=validators)
 
+        if status == NOT_MODIFIED_STATUS and entry:
+            self.discovery_cache.touch(url)
+            return 200, {'Link': entry.get('link') or ''}, entry['data']
+
+        if status == 200:
+            self.discovery_cache.put(url, data, headers)
+
+        return status, headers, data
+
+    def get_listing_pages(self, url):
+        '''
+        Yields `(status, data)` for every page of a discovery listing. Like results, listings
+        continue on a next page while their Link header has a `next` relation.
+        '''
+        page_number = 1
+
+        while True:
+            page_url = url if page_number == 1 else '{}?page={}'.format(url, page_number)
+            status, headers, data = self.get_listing(page_url)
+            yield status, data
+
+            if status != 200 or not ('Link' in headers and '; rel="next"' in headers['Link']):
+                return
+
+            page_number += 1
+
+    def fetch_audits(self):
+        '''
+        Requests Typo for the list of available Audit's
+        '''
         url = '{}/audits'.format(
             self.base_url)
 
-        # Get request
-        response = self.api_get_request(url)
+        data = []
+        for status, page_data in self.get_listing_pages(url):
+            # Check Status
+            if status != 200:
+                log_critical(page_data['message'])
+                sys.exit(1)
 
-        status = response[0]
-        data = response[2]['data']
+            data += page_data['data']
 
-        # NOTE: Filter datasets that has models.
+        # NOTE: Filter audits that are completed and have a schema.
 
         def transform_dataset(dataset):
             dataset['is_audit'] = True
             return dataset
 
-        data = [transform_dataset(d) for d in data if d['state'] == 'COMPLETED' and d['schema'] is not None]
-
-        # Check Status
-        if status != 200:
-            log_critical(data['message'])
-            sys.exit(1)
-
-        return data
+        return [d for d in map(transform_dataset, data) if has_results(d)]
 
     def fetch_datasets(self):
         '''
@@ -125,11 +310,14 @@ class TapTypo():
         url = '{}/datasets'.format(
             self.base_url)
 
-        # Get request
-        response = self.api_get_request(url)
+        data = []
+        for status, page_data in self.get_listing_pages(url):
+            # Check Status
+            if status != 200:
+                log_critical(page_data['message'])
+                sys.exit(1)
 
-        status = response[0]
-        data = response[2]
+            data += page_data
 
         # NOTE: Filter datasets that have models.
 
@@ -137,14 +325,7 @@ class TapTypo():
             dataset['is_audit'] = False
             return dataset
 
-        data = [transform_dataset(d) for d in data if len(d['models']) > 0]
-
-        # Check Status
-        if status != 200:
-            log_critical(data['message'])
-            sys.exit(1)
-
-        return data
+        return [d for d in map(transform_dataset, data) if has_results(d)]
 
     def fetch_dataset_information(self):
         '''
@@ -171,45 +352,29 @@ class TapTypo():
         return data
 
     def get_catalog_entry(self, data):
-        key_properties, schema, sqltypes, datetime_formats = self.compute_schema(data)
+        key_properties, schema, _, _, field_metadata = self.compute_schema(data)
 
-        repository = data['repository']['name']
-        audit_id = None
-        if data['is_audit']:
-            audit_id = data['id']
-            dataset = data['dataset']['name']
-        else:
-            dataset = data['name']
+        repository, dataset, audit_id = get_stream_names(data)
 
         stream_id = get_tap_stream_id(repository, dataset, audit_id)
 
-        metadata = singer.metadata.get_standard_metadata(
-            schema=schema, schema_name=stream_id,
-            key_properties=key_properties)
-
-        index = 0
-        total_keys = len(metadata)
-
-        while index < total_keys:
-            # NOTE: Check if its metadata for stream
-            if len(metadata[index]['breadcrumb']) == 0:
-                metadata[index]['metadata']['repository'] = repository
-                metadata[index]['metadata']['dataset'] = dataset
-                metadata[index]['metadata']['audit_id'] = audit_id
-                metadata[index]['metadata']['is-view'] = data['is_audit']
-                database_name = data['repository']['name']
-                metadata[index]['metadata']['database-name'] = database_name
-                row_count = data['total_records']
-                metadata[index]['metadata']['row-count'] = row_count
-                metadata[index]['metadata']['valid-replication-keys'] = [TYPO_RECORD_ID_PROPERTY]
-                metadata[index]['metadata']['selected-by-default'] = False  # Datasets are not selected by default.
-            else:
-                metadata[index]['metadata']['selected-by-default'] = True   # Fields are selected by default.
-                field_name = metadata[index]['breadcrumb'][1]
-                metadata[index]['metadata']['sql-datatype'] = sqltypes[field_name]
-                if field_name in datetime_formats:
-                    metadata[index]['metadata']['datetime-format'] = datetime_formats[field_name]
-            index += 1
+        stream_metadata = {
+            'table-key-properties': key_properties,
+            'inclusion': 'available',
+            'schema-name': stream_id,
+            'repository': repository,
+            'dataset': dataset,
+            'audit_id': audit_id,
+            'is-view': data['is_audit'],
+            'database-name': data['repository']['name'],
+            'row-count': data.get('total_records'),
+            'valid-replication-keys': [TYPO_RECORD_ID_PROPERTY],
+            'selected-by-default': False,  # Datasets are not selected by default.
+            'updated-at': data.get('updated_at')
+        }
+
+        # NOTE: Field metadata is computed along with the schema
+        metadata = [{'breadcrumb': (), 'metadata': stream_metadata}] + field_metadata
 
         return {
             'stream': stream_id,
@@ -220,103 +385,95 @@ class TapTypo():
             'bookmark_properties': [TYPO_RECORD_ID_PROPERTY]
         }
 
-    def compute_schema(self, data):
-        typo_schema = data.get('schema')
+    def get_configured_catalog_entry(self):
+        '''
+        Builds the catalog entry of the stream named by the `repository`, `dataset` and `audit_id`
+        config parameters from its basic information, without listing every dataset and audit.
+        Returns None when discovery would leave the stream out, as it has no results to sync.
+        '''
+        information = self.fetch_dataset_information()['data']
 
-        schema_properties = {}
-        key_properties = [TYPO_RECORD_ID_PROPERTY]
+        # NOTE: Give the information the shape of a datasets or audits listing item
+        data = dict(information)
+        data['repository'] = {'name': self.repository}
+        data['is_audit'] = bool(self.audit_id)
 
-        available_sql_types = {
-            'number': 'float',
-            'integer': 'int',
-            'string': 'varchar(255)',
-            'date-time': 'datetime',
-            'boolean': 'bool'
-        }
+        dataset = information.get('dataset') or {}
+        if data.get('schema') is None:
+            data['schema'] = dataset.get('schema')
 
-        default_sql_type = 'varchar(255)'
-
-        sql_types = {}
-        datetime_formats = {}
-
-        if typo_schema is not None:
-            for field, spec in typo_schema.items():
-                if 'primary' in spec and spec['primary']:
-                    key_properties.append(field)
-
-                field_type = ''
-                field_format = None
-                if 'type' in spec:
-                    # Only add spec for fields we can identify with certainty
-                    if spec['type'] == 'float' or spec['type'] == 'number':
-                        field_type = 'number'
-                    elif spec['type'] == 'integer' or spec['type'] == 'int' or spec['type'] == 'smallint':
-                        field_type = 'integer'
-                    elif spec['type'] == 'varchar' or spec['type'] == 'string':
-                        field_type = 'string'
-                    elif spec['type'] == 'date-time':
-                        field_type = 'string'
-                        if spec.get('format') is not None and self.output_rfc3339_datetime:
-                            field_format = 'date-time'
-                            datetime_formats[field] = spec.get('format')
-                    else:
-                        field_type = 'string'
-
-                    if field_format:
-                        schema_properties[field] = {
-                            'type': ['null', field_type],
-                            'format': field_format
-                        }
-                    else:
-                        schema_properties[field] = {
-                            'type': ['null', field_type]
-                        }
-                    sql_types[field] = available_sql_types.get(field_type, default_sql_type)
-                else:
-                    schema_properties[field] = {}
-
-        # NOTE: Add Typo specific properties
-        schema_properties[TYPO_RESULT_PROPERTY] = {
-            'type': 'string'
-        }
-        sql_types[TYPO_RESULT_PROPERTY] = 'varchar(255)'
+        if self.audit_id:
+            data['id'] = self.audit_id
+            data['dataset'] = dict(dataset, name=self.dataset)
+        else:
+            data['name'] = self.dataset
 
-        schema_properties[TYPO_RECORD_ID_PROPERTY] = {
-            'type': 'integer'
-        }
-        sql_types[TYPO_RECORD_ID_PROPERTY] = 'int'
+        if not has_results(data, partial=True):
+            return None
 
-        schema = {
-            'type': 'object',
-            'additionalProperties': True,
-            'properties': schema_properties
-        }
+        return self.get_catalog_entry(data)
 
-        return key_properties, schema, sql_types, datetime_formats
+    def compute_schema(self, data):
+        return self.schema_compiler.compile(data.get('schema'))
 
-    def get_catalog_entries(self):
+    def get_catalog_entries(self, previous_catalog=None):
         '''
         Requests Typo for an Audit or Streaming Dataset's basic information
         and builds the catalog entries metadata.
+
+        When a previous catalog is provided, its entries are reused for the datasets and audits
+        whose `updated_at` did not change. Rebuilt entries keep their previous field selection.
         '''
-        datasets = self.fetch_datasets()
-        audits = self.fetch_audits()
+        # Both listings are requested at the same time
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix='tap-typo-discovery') as executor:
+            datasets = executor.submit(self.fetch_datasets)
+            audits = executor.submit(self.fetch_audits)
 
-        data = datasets + audits
+            data = datasets.result() + audits.result()
 
         # Transform dataset information into catalog metadata
 
-        entries = [self.get_catalog_entry(d) for d in data]
+        if previous_catalog is None:
+            return [self.get_catalog_entry(d) for d in data]
+
+        previous_index = CatalogIndex(previous_catalog)
+        previous_entries = dict(previous_index.streams)
+        entries = []
+        reused = 0
+
+        for item in data:
+            stream_id = get_tap_stream_id(*get_stream_names(item))
+            previous_entry = previous_entries.pop(stream_id, None)
+
+            if previous_entry is not None:
+                previous_updated_at = previous_index.get_stream_metadata(stream_id, 'updated-at')
+
+                if previous_updated_at is not None and previous_updated_at == item.get('updated_at'):
+                    entries.append(previous_entry)
+                    reused += 1
+                    continue
+
+            entry = self.get_catalog_entry(item)
+            if previous_entry is not None:
+                carry_over_selection(previous_entry, entry)
+            entries.append(entry)
+
+        log_info('Incremental discovery: {} entries reused, {} rebuilt, {} removed.'.format(
+            reused, len(entries) - reused, len(previous_entries)))
+
         return entries
 
     def get_catalog(self):
         '''
-        Builds the catalog from the provided config
+        Builds the catalog from the provided config. The catalog is only discovered once per run.
         '''
-        catalog_entries = self.get_catalog_entries()
-        return {
-            'streams': catalog_entries
-        }
+        if self.discovered_catalog is None:
+            catalog_entries = self.get_catalog_entries(self.previous_catalog)
+            self.discovered_catalog = {
+                'streams': catalog_entries
+            }
+
+        return self.discovered_catalog
 
     def discover(self):
         '''
@@ -325,12 +482,63 @@ class TapTypo():
         catalog = self.get_catalog()
         print(json.dumps(catalog, indent=2))
 
+    def send_request(self, send, url, **kwargs):
+        '''
+        Sends a request with `send`, a session method, within the rate limits. Rate limited
+        requests and server errors are sent again as allowed by the retry policy, the last
+        response is returned once it gives up. A 429 holds every request, not only this one.
+        '''
+        started_at = time.monotonic()
+        attempt = 0
+
+        while True:
+            with self.rate_limiter:
+                response = send(url, **kwargs)
+
+            self.rate_limiter.update(response.headers)
+
+            status = response.status_code
+            if not self.retry_policy.is_retryable(status):
+                return response
+
+            attempt += 1
+            delay = self.get_retry_delay(status, response.headers, attempt, started_at)
+            if delay is None:
+                return response
+
+            response.close()
+            time.sleep(delay)
+
+    def get_retry_delay(self, status, headers, attempt, started_at):
+        '''
+        Decides whether a request that got a retryable `status` is sent again for its `attempt`-th retry.
+        Returns None when the retry policy gives up, otherwise the seconds to sleep before retrying.
+        A 429 holds every request through the rate limiter instead, so no sleep is needed.
+        '''
+        retry_after = get_retry_after(headers)
+        if retry_after is None and status == TOO_MANY_REQUESTS_STATUS:
+            retry_after = get_rate_limit_reset(headers)
+        delay = self.retry_policy.get_delay(attempt, retry_after)
+
+        if not self.retry_policy.should_retry(attempt, started_at, delay):
+            return None
+
+        self.retry_policy.record(str(status))
+        log_info('Typo answered with status {}. Sleeping {:.1f} seconds before trying again ({}/{}).'.format(
+            status, delay, attempt, self.retry_policy.max_retries))
+
+        if status == TOO_MANY_REQUESTS_STATUS:
+            self.rate_limiter.pause(delay)
+            return 0
+
+        return delay
+
     # pylint: disable=no-self-use
     @backoff.on_exception(
         backoff.expo,
         (requests.exceptions.Timeout, requests.exceptions.ConnectionError),
         max_tries=8,
-        on_backoff=log_backoff,
+        on_backoff=backoff_retry,
         on_giveup=backoff_giveup,
         logger=None,
         factor=3
@@ -339,13 +547,13 @@ class TapTypo():
         '''
         Generic POST request
         '''
-        response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=20)
+        response = self.send_request(self.session.post, url, headers=headers, data=json.dumps(payload), timeout=20)
 
         status = response.status_code
-        data = response.json()
 
         # Check response status
         if status not in GOOD_STATUS:
+            data = get_error_data(response)
             if isinstance(data, dict) and 'message' in data.keys():
                 log_error(('Post request failed. Please verify your config and try again later. Error message: {}. ' +
                            'Request url=[{}], request status_code=[{}].').format(
@@ -354,29 +562,71 @@ class TapTypo():
                 log_error(('Post request failed. Please verify your config and try again later. url=[{}], ' +
                            'request.status_code=[{}], response.text=[{}].').format(
                                url, response.status_code, response.text))
+            return status, data
 
-        return status, data
+        return status, response.json()
 
     @backoff.on_exception(
         backoff.expo,
         (requests.exceptions.Timeout, requests.exceptions.ConnectionError),
         max_tries=8,
-        on_backoff=log_backoff,
+        on_backoff=backoff_retry,
+        on_giveup=backoff_giveup,
+        logger=None,
+        factor=3
+    )
+    def get_request(  # pylint: disable=too-many-arguments
+            self, url, headers, params=None, stream_prefix=None, allow_unauthorized=False, raw=False):
+        '''
+        Generic GET request, retried on timeouts and connection errors. See `send_get_request`.
+        '''
+        return self.send_get_request(url, headers, params, stream_prefix, allow_unauthorized, raw)
+
+    @backoff.on_exception(
+        backoff.expo,
+        requests.exceptions.ConnectionError,
+        max_tries=8,
+        on_backoff=backoff_retry,
         on_giveup=backoff_giveup,
         logger=None,
         factor=3
     )
-    def get_request(self, url, headers, params=None):
+    def get_request_raising_timeouts(  # pylint: disable=too-many-arguments
+            self, url, headers, params=None, stream_prefix=None, allow_unauthorized=False, raw=False):
+        '''
+        Generic GET request, retried on connection errors while read timeouts are raised to the caller.
+        See `send_get_request`.
+        '''
+        return self.send_get_request(url, headers, params, stream_prefix, allow_unauthorized, raw)
+
+    def send_get_request(  # pylint: disable=too-many-arguments
+            self, url, headers, params=None, stream_prefix=None, allow_unauthorized=False, raw=False):
         '''
-        Generic GET request
+        Generic GET request, not retried. When `stream_prefix` is provided, a successful response is parsed
+        incrementally and its data is a generator of the items found at that prefix. With `raw`, the data
+        of a successful response is its body, left unparsed.
+        A 304 Not Modified response to a conditional request has no data, as does a
+        401 Unauthorized response when `allow_unauthorized` is set.
         '''
-        response = requests.get(url, headers=headers, params=params, timeout=20)
+        stream = stream_prefix is not None
+        response = self.send_request(
+            self.session.get, url, headers=headers, params=params, timeout=20, stream=stream)
         status = response.status_code
-        data = response.json()
         headers = response.headers
 
+        if status == NOT_MODIFIED_STATUS or (status == UNAUTHORIZED_STATUS and allow_unauthorized):
+            response.close()
+            return status, headers, None
+
+        if stream and status in GOOD_STATUS:
+            return status, headers, iter_json_items(response, stream_prefix)
+
+        if raw and status in GOOD_STATUS:
+            return status, headers, response.content
+
         # Check response status
         if status not in GOOD_STATUS:
+            data = get_error_data(response)
             if isinstance(data, dict) and 'message' in data.keys():
                 log_error(('Get request failed. Please verify your config and try again later. Error message: {}. ' +
                            'Request url=[{}], request status_code=[{}].').format(
@@ -387,31 +637,43 @@ class TapTypo():
                                url, response.status_code, response.text))
             sys.exit(1)
 
-        return status, headers, data
+        return status, headers, response.json()
 
-    def api_get_request(self, url, params=None):
+    def api_get_request(  # pylint: disable=too-many-arguments
+            self, url, params=None, stream_prefix=None, headers=None, retry_timeouts=True, raw=False):
         '''
-        Make a GET request to the Typo API
+        Make a GET request to the Typo API, adding `headers` to the default ones. See `send_get_request`.
+        A request rejected with a 401 is retried once with a new token. Unless `retry_timeouts`
+        is set, read timeouts are raised to the caller instead of being retried.
         '''
-        if not self.token:
-            self.token = self.request_token()
+        get_request = self.get_request if retry_timeouts else self.get_request_raising_timeouts
 
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': 'Bearer {}'.format(self.token)
-        }
+        def get_headers(token):
+            request_headers = dict(headers or {})
+            request_headers.update({
+                'Content-Type': 'application/json',
+                'Authorization': 'Bearer {}'.format(token)
+            })
+            return request_headers
 
-        status, response_headers, data = self.get_request(url, headers, params)
+        token = self.get_token()
+        status, response_headers, data = get_request(
+            url, get_headers(token), params, stream_prefix, allow_unauthorized=True, raw=raw)
 
-        # Expired token
-        if status == 401:
-            self.token = self.request_token()
-
-            # Retry post_request with new token
-            status, response_headers, data = self.get_request(url, headers, params)
+        # Expired or revoked token: requests that used it share a single refresh
+        if status == UNAUTHORIZED_STATUS:
+            token = self.token_manager.refresh(token)
+            status, response_headers, data = get_request(url, get_headers(token), params, stream_prefix, raw=raw)
 
         return status, response_headers, data
 
+    def get_token(self):
+        '''
+        Returns the current access token, requesting one if there is none yet or it expired.
+        Concurrent callers wait for a single token request.
+        '''
+        return self.token_manager.get_token()
+
     def request_token(self):
         '''
         Token Request for other requests
@@ -441,62 +703,21 @@ class TapTypo():
 
         return data['token']
 
-    def get_page(self, repository, dataset, audit_id, page_number):
-        '''
-        Fetches one page of results from the Typo API
-        '''
-        log_info('Fetching page {}.'.format(page_number))
-
-        if audit_id is not None:
-            base_url = '{}/repositories/{}/datasets/{}/audits/{}/results'.format(
-                self.base_url, repository, dataset, audit_id)
-        else:
-            base_url = '{}/repositories/{}/datasets/{}/results'.format(
-                self.base_url, repository, dataset)
-
-        # Get request
-        start_record_id_filter = ''
-
-        if self.start_record_id != OPTION_DISABLED:
-            start_record_id_filter = '&__typo_id=gt:{}'.format(self.start_record_id)
-
-        status, headers, data = self.api_get_request('{}?records_per_page={}&page={}{}'.format(
-            base_url, self.records_per_page, page_number, start_record_id_filter))
-
-        # Check Status
-        if status != 200:
-            log_error(data['message'])
-            sys.exit(1)
-
-        eof = not ('Link' in headers and '; rel="next"' in headers['Link'])
-        return data, eof
-
     def get_selected_streams(self):
         '''
         Checks stream schema's metadata looking for an empty breadcrumb that has in it's metadata
         property `selected` set to True or has `selected-by-default` set to True.
         '''
-        selected_streams = []
-
-        for stream in self.catalog['streams']:
-            stream_metadata = singer.metadata.to_map(stream['metadata'])
-
-            # stream metadata will have an empty breadcrumb
-            selected = singer.metadata.get(stream_metadata, (), 'selected')
-
-            if selected or (selected is not False and singer.metadata.get(stream_metadata, (), 'selected-by-default')):
-                selected_streams.append(stream['tap_stream_id'])
-
-        return selected_streams
+        return [stream_id for stream_id in self.catalog_index.streams if self.catalog_index.is_selected(stream_id)]
 
-    def setup_tap_from_state(self):
+    def setup_tap_from_state(self, stream_id):
         '''
-        Looks into the state for a bookmark corresponding to the current stream, if found,
-        it sets up the tap to start from the bookmark.
+        Looks into the state for a bookmark corresponding to the stream, if found,
+        returns the record id the stream should start after.
         '''
         try:
             # Check if there's a bookmark available in the state
-            self.start_record_id = self.state['bookmarks'][self.stream_id][TYPO_RECORD_ID_PROPERTY]
+            start_record_id = self.state['bookmarks'][stream_id][TYPO_RECORD_ID_PROPERTY]
 
             record_limit_log_message = ''
 
@@ -506,103 +727,248 @@ class TapTypo():
             log_info((
                 'Syncing stream `{}`. Resuming from provided state file. Start Typo record id: {}. ' +
                 'Records per page: {}{}.').format(
-                    self.stream_id,
-                    self.start_record_id,
+                    stream_id,
+                    start_record_id,
                     self.records_per_page,
                     record_limit_log_message
                 ))
 
+            return start_record_id
+
         except KeyError:
             log_info('Syncing stream `{}`. Records per page: {}.{}'.format(
-                self.stream_id, self.records_per_page,
+                stream_id, self.records_per_page,
                 ' Record limit: {}.'.format(self.record_limit) if self.record_limit != OPTION_DISABLED else ''))
 
-    def sync_stream(self, stream):
-        self.key_properties = stream['key_properties']
-        self.schema = stream['schema']
-        self.stream_id = stream['tap_stream_id']
-        self.start_record_id = OPTION_DISABLED
+            return OPTION_DISABLED
 
-        stream_metadata = singer.metadata.to_map(stream['metadata'])
-        repository = singer.metadata.get(stream_metadata, (), 'repository')
-        dataset = singer.metadata.get(stream_metadata, (), 'dataset')
-        audit_id = singer.metadata.get(stream_metadata, (), 'audit_id')
+    def resume_from_checkpoint(self, path):
+        '''
+        Moves the bookmarks of the state forward to the ones of a previous run's checkpoint.
+        The checkpoint is more recent than the last STATE a target received when that run crashed.
+        '''
+        if not path:
+            log_critical('Resuming from a checkpoint requires a checkpoint file path '
+                         + 'or the checkpoint_file config parameter.')
+            sys.exit(1)
 
-        self.setup_tap_from_state()
+        checkpoint_state = load_checkpoint(path)
+        if checkpoint_state is None:
+            log_info('No checkpoint found in {}. Starting from the provided state.'.format(path))
+            return
 
-        # Output state and schema
-        singer.write_state(self.state)
-        singer.write_schema(self.stream_id, self.schema, self.key_properties,
-                            bookmark_properties=BOOKMARK_PROPERTIES)
+        log_info('Resuming from checkpoint {}.'.format(path))
+        self.state = merge_bookmarks(self.state, checkpoint_state, TYPO_RECORD_ID_PROPERTY)
+
+    def write_state(self):
+        '''
+        Outputs the current state
+        '''
+        with self.state_lock:
+            self.output.write_state(self.state)
+
+    def update_bookmark(self, stream_id, bookmark):
+        '''
+        Updates the bookmark of a stream. Streams synced in parallel share the same state,
+        so every STATE message carries the bookmarks of all the streams.
+        '''
+        with self.state_lock:
+            self.state = singer.write_bookmark(self.state, stream_id, TYPO_RECORD_ID_PROPERTY, bookmark)
+
+    def sync_stream(self, stream):
+        stream_sync = self.start_stream(stream)
+
+        pages = self.pager.get_stream_pages(stream_sync)
 
         eof = False
-        record_count = 0
-        record_limit_reached = False
-        page_number = 1
+        try:
+            for data, eof in pages:
+                if not self.write_page(stream_sync, data['data']['records']):
+                    break
+            else:
+                # Every page was consumed, unless paging stopped early
+                eof = not self.sync_stopped.is_set()
+        finally:
+            pages.close()
+            self.finish_stream(stream_sync)
+
+        if eof:
+            log_info('Finished syncing all available data for stream `{}`.'.format(stream_sync.stream_id))
+
+    def start_stream(self, stream):
+        '''
+        Outputs the state and schema of a stream about to be synced and
+        returns what is needed to write its pages
+        '''
+        stream_id = stream['tap_stream_id']
+
+        start_record_id = self.setup_tap_from_state(stream_id)
+
+        # Deselected fields are left out of the schema and the records
+        schema = stream['schema']
+        excluded_fields = self.catalog_index.get_excluded_fields(stream_id)
+        if excluded_fields:
+            schema = dict(schema, properties={
+                field_name: field_schema for field_name, field_schema in schema['properties'].items()
+                if field_name not in excluded_fields
+            })
+
+        # Output state and schema
+        self.write_state()
+        self.output.write_message(singer.SchemaMessage(
+            stream=stream_id, schema=schema, key_properties=stream['key_properties'],
+            bookmark_properties=BOOKMARK_PROPERTIES))
 
         # Get the fields that will need rfc3339 transformations.
         rfc3339_fields_format = {}
         if self.output_rfc3339_datetime:
-            for field_path, field_metadata in stream_metadata.items():
-                # NOTE: Checking for tuples that are not empty that represent field metadata
-                if field_path and 'datetime-format' in field_metadata:
-                    field_name = field_path[1]
-                    rfc3339_fields_format[field_name] = field_metadata['datetime-format']
-
-        while not eof and not record_limit_reached:
-            data, eof = self.get_page(repository, dataset, audit_id, page_number)
-
-            for record in data['data']['records']:
-                record_count += 1
+            rfc3339_fields_format = self.catalog_index.get_datetime_formats(stream_id, excluded_fields)
+
+        datetime_converter = None
+        if rfc3339_fields_format:
+            datetime_converter = DatetimeConverter(rfc3339_fields_format, self.datetime_cache_size)
+
+        return StreamSync(
+            stream_id,
+            self.catalog_index.get_stream_metadata(stream_id, 'repository'),
+            self.catalog_index.get_stream_metadata(stream_id, 'dataset'),
+            self.catalog_index.get_stream_metadata(stream_id, 'audit_id'),
+            start_record_id,
+            RecordTransformer(datetime_converter, excluded_fields),
+            StateEmissionPolicy(self.state_every_records, self.state_every_seconds, self.state_every_page),
+            get_render_options(
+                stream_id, rfc3339_fields_format, self.datetime_cache_size, excluded_fields, self.fast_json))
+
+    def write_page(self, stream_sync, records):
+        '''
+        Outputs the records of a results page. Returns False once the record limit is reached
+        or when another stream failed.
+        '''
+        stream_id = stream_sync.stream_id
+        if self.sync_stopped.is_set():
+            log_info('Another stream failed. Stopping syncing for stream `{}`.'.format(stream_id))
+            return False
 
-                # Inserting output results from Typo
-                record_data = record['record']
+        state_policy = stream_sync.state_policy
+        record_count = stream_sync.record_count
 
-                if record['has_errors']:
-                    record_data['__typo_result'] = 'Error'
-                else:
-                    record_data['__typo_result'] = 'OK'
+        if isinstance(records, RenderedRecords):
+            # Already rendered by a worker process
+            rendered_records = zip(records.record_ids, records.lines)
+        else:
+            # Whole pages are transformed at once, streamed records one at a time
+            if isinstance(records, list):
+                records_data = stream_sync.transformer.transform_page(records)
+            else:
+                records_data = map(stream_sync.transformer.transform_record, records)
 
-                record_data[TYPO_RECORD_ID_PROPERTY] = record['id']
+            render_record = self.output.render_record
+            rendered_records = (
+                (record_data[TYPO_RECORD_ID_PROPERTY], render_record(stream_id, record_data))
+                for record_data in records_data)
 
-                if self.output_rfc3339_datetime:
-                    # Iterate fields that needs transformation into rfc3339
-                    for field_name, field_format in rfc3339_fields_format.items():
-                        original_value = record_data[field_name]
-                        parsed_datetime = datetime.strptime(original_value, field_format)
-                        rfc3339_datetime = rfc3339(parsed_datetime)
-                        record_data[field_name] = rfc3339_datetime
+        try:
+            for record_id, line in rendered_records:
+                record_count += 1
 
                 # Output record
-                singer.write_record(self.stream_id, record_data)
+                self.output.write_line(line)
 
-                bookmark = record['id']
+                self.update_bookmark(stream_id, record_id)
 
-                self.state = singer.write_bookmark(self.state, self.stream_id, TYPO_RECORD_ID_PROPERTY, bookmark)
-                singer.write_state(self.state)
+                if state_policy.record_done():
+                    self.write_state()
+                    state_policy.emitted()
 
                 if (self.record_limit != OPTION_DISABLED
                         and record_count == self.record_limit):
-                    record_limit_reached = True
-                    log_info('Record limit reached. Finishing syncing for stream `{}`.'.format(self.stream_id))
-                    break
+                    log_info('Record limit reached. Finishing syncing for stream `{}`.'.format(stream_id))
+                    return False
+        finally:
+            stream_sync.record_count = record_count
 
-            page_number += 1
+        if state_policy.page_done():
+            self.write_state()
+            state_policy.emitted()
 
-        if eof:
-            log_info('Finished syncing all available data for stream `{}`.'.format(self.stream_id))
+        self.output.flush()
+        return True
+
+    def finish_stream(self, stream_sync):
+        '''
+        Outputs the bookmark of the last written record, even when exiting on an error
+        '''
+        if stream_sync.state_policy.pending:
+            self.write_state()
+
+        self.output.flush()
+
+    def sync_streams_parallel(self, streams):
+        '''
+        Syncs up to `max_parallel_streams` streams at once. Workers queue their messages and
+        the calling thread is the only one writing them to stdout, so each stream keeps its
+        SCHEMA, RECORD and STATE ordering.
+        '''
+        # Authenticate once instead of once per worker
+        self.get_token()
+
+        output = self.output
+        self.output = QueuedMessageWriter(self.fast_json, checkpoint=self.checkpoint)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_parallel_streams,
+                                    thread_name_prefix='tap-typo-stream') as executor:
+                futures = [executor.submit(self.sync_stream, stream) for stream in streams]
+                self.output.drain(futures, self.sync_stopped)
+
+            for future in futures:
+                if not future.cancelled():
+                    future.result()
+        finally:
+            if self.output.written_state is not None:
+                output.written_state = self.output.written_state
+            self.output = output
 
     def sync(self, catalog_mode=False):
         '''
         Parse every stream in the catalog, fetch data from Typo and send to stdout
         '''
+        if self.transform_processes > 0:
+            self.render_pool = create_render_pool(self.transform_processes)
+
+        try:
+            self.sync_streams(catalog_mode)
+        finally:
+            if self.render_pool is not None:
+                self.render_pool.shutdown()
+                self.render_pool = None
+
+            # The checkpoint ends on the last STATE message, whatever the cadence
+            self.output.flush(force_checkpoint=True)
+
+            if self.retry_policy.counts:
+                log_info('Retried requests: {}.'.format(', '.join(
+                    '{} x{}'.format(reason, count) for reason, count in sorted(self.retry_policy.counts.items()))))
+
+    def sync_streams(self, catalog_mode):
+        '''
+        Syncs the selected catalog streams in catalog mode, the configured stream otherwise
+        '''
         if catalog_mode:
-            selected_streams = self.get_selected_streams()
-            for stream in self.catalog['streams']:
-                if stream['tap_stream_id'] not in selected_streams:
-                    log_info('Skipped stream `{}`: stream not selected for syncing.'.format(stream['tap_stream_id']))
+            streams = []
+            for stream_id, stream in self.catalog_index.streams.items():
+                if not self.catalog_index.is_selected(stream_id):
+                    log_info('Skipped stream `{}`: stream not selected for syncing.'.format(stream_id))
                     continue
-                self.sync_stream(stream)
+                streams.append(stream)
+
+            if self.engine == ENGINE_ASYNC:
+                AsyncEngine(self).sync(streams)
+            elif self.max_parallel_streams > 1 and len(streams) > 1:
+                self.sync_streams_parallel(streams)
+            else:
+                for stream in streams:
+                    self.sync_stream(stream)
         else:
             if not self.repository and not self.dataset:
                 log_info('Nothing to do as not running in catalog mode and repository,'
@@ -612,9 +978,13 @@ class TapTypo():
                 dataset = self.dataset
                 audit_id = self.audit_id
                 stream_id = get_tap_stream_id(repository, dataset, audit_id)
-                streams = [stream for stream in self.catalog['streams'] if stream['tap_stream_id'] == stream_id]
-                if len(streams) == 0:
+                stream = self.catalog_index.get_stream(stream_id)
+                if stream is None:
                     log_info('Nothing do to. Cannot find a stream for the provided repository, '
                              + 'dataset and audit_id config parameters.')
                     return
-                self.sync_stream(streams[0])
+
+                if self.engine == ENGINE_ASYNC:
+                    AsyncEngine(self).sync([stream])
+                else:
+                    self.sync_stream(stream)
@@ -0,0 +1,94 @@
+# Copyright 2019-2020 Typo. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+# This product includes software developed at or by Typo (https://www.typo.ai/).
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+
+from tap_typo.output import get_json_encoder, get_record_prefix
+from tap_typo.transform import TYPO_RECORD_ID_PROPERTY, DatetimeConverter, RecordTransformer
+
+
+# The records of a results page, rendered into RECORD messages, and their Typo record ids
+RenderedRecords = namedtuple('RenderedRecords', ['record_ids', 'lines'])
+
+# What a worker process needs to transform and render the records of a stream. Sent with every page,
+# so it only holds the stream id and settings, as hashable values.
+RenderOptions = namedtuple('RenderOptions', ['stream_id', 'datetime_formats', 'datetime_cache_size',
+                                             'excluded_fields', 'fast_json'])
+
+# Page renderers of the worker process, compiled once per stream
+_renderers = {}
+
+
+def create_render_pool(processes):
+    '''
+    Starts the worker processes rendering records. Where available, workers are forked from a
+    server process that imported this module once, rather than from the tap, as the tap's threads
+    may hold locks while a worker is started.
+    '''
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+    else:
+        context = multiprocessing.get_context('spawn')
+
+    return ProcessPoolExecutor(max_workers=processes, mp_context=context)
+
+
+def get_render_options(stream_id, datetime_formats, datetime_cache_size, excluded_fields, fast_json):
+    '''
+    Returns the render options of a stream
+    '''
+    return RenderOptions(
+        stream_id, tuple(sorted(datetime_formats.items())), datetime_cache_size,
+        tuple(sorted(excluded_fields)), fast_json)
+
+
+def get_page_renderer(options):
+    '''
+    Returns the function rendering the records of a results page with `options`
+    '''
+    renderer = _renderers.get(options)
+    if renderer is not None:
+        return renderer
+
+    datetime_converter = None
+    if options.datetime_formats:
+        datetime_converter = DatetimeConverter(dict(options.datetime_formats), options.datetime_cache_size)
+    transform_page = RecordTransformer(datetime_converter, options.excluded_fields).transform_page
+
+    prefix = get_record_prefix(options.stream_id)
+    dumps = get_json_encoder(options.fast_json)
+
+    def render_page(records):
+        records_data = transform_page(records)
+        return RenderedRecords(
+            [record_data[TYPO_RECORD_ID_PROPERTY] for record_data in records_data],
+            [prefix + dumps(record_data) + '}' for record_data in records_data])
+
+    _renderers[options] = render_page
+    return render_page
+
+
+def render_results_page(options, body):
+    '''
+    Parses the body of a results page response, then transforms its records and renders them
+    into RECORD messages, like the tap does when writing them. Runs in a worker process: only
+    the body is sent to it, rather than the parsed records, which cost more to send.
+    '''
+    return get_page_renderer(options)(json.loads(body)['data']['records'])
@@ -35,38 +35,64 @@ TapTypo tests
 #
 # or by Typo (https://www.typo.ai/).
 
+import asyncio
+import base64
+from datetime import datetime
 from io import StringIO
 import json
+import os
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import patch
+from rfc3339 import rfc3339
+import requests
 import singer
 
+from tap_typo.aio import AsyncEngine, aiohttp
+from tap_typo.auth import TokenManager, get_token_expiry
+from tap_typo.catalog import CatalogIndex
+from tap_typo.checkpoint import Checkpoint, load_checkpoint
+from tap_typo.output import MessageWriter, QueuedMessageWriter
+from tap_typo.paging import AdaptivePageSize
+from tap_typo.ratelimit import RateLimiter, get_rate_limit_reset, get_retry_after
+from tap_typo.retry import RetryPolicy
+from tap_typo.schema import SchemaCompiler, compile_schema
+from tap_typo.transform import DatetimeConverter
 from tap_typo.typo import TapTypo
 from test_utils.mock_functions import (
+    MockRequestResponse,
     mock_requests_get_test_discover_mode,
     mock_requests_get_test_resume_with_state, mock_requests_get_test_get_simple_audit_dataset,
     mock_requests_get_test_get_simple_streaming_dataset, mock_requests_get_test_multi_page_no_limit,
-    mock_requests_post_get_token, mock_requests_get_test_request_token
+    mock_requests_post_get_token, mock_requests_get_test_request_token,
+    mock_requests_get_test_parallel_streams, mock_requests_get_test_keyset_pagination,
+    generate_audit_dataset_header_response, generate_streaming_dataset_header_response,
+    generate_audit_dataset_response, generate_audit_listing_response
 )
 from test_utils.outputs import (
     TEST_DISCOVER_MODE_OUTPUT, TEST_RESUME_WITH_STATE_OUTPUT,
     TEST_GET_SIMPLE_AUDIT_DATASET_OUTPUT, TEST_GET_SIMPLE_STREAMING_DATASET_OUTPUT,
     TEST_MULTI_PAGE_NO_LIMIT_OUTPUT
 )
-from test_utils.utils import generate_config
+from test_utils.utils import generate_config, generate_record
 
 # Singer Logger
 LOGGER = singer.get_logger()
 
+# Request mocks take the arguments of the requests.Session methods they replace
+# pylint: disable=unused-argument,too-many-arguments,too-many-lines
 
-class TestTapTypo(unittest.TestCase):
+
+class TestTapTypo(unittest.TestCase):  # pylint: disable=too-many-public-methods
     '''
     TapTypo tests
     '''
     maxDiff = None  # Get the full diff when debugging tests
 
-    @patch('tap_typo.typo.requests.post')
-    @patch('tap_typo.typo.requests.get', new=mock_requests_get_test_request_token)
+    @patch('tap_typo.typo.requests.Session.post')
+    @patch('tap_typo.typo.requests.Session.get', new=mock_requests_get_test_request_token)
     def test_request_token(self, mock_post):
         '''
         Request an access token from Typo
@@ -98,8 +124,91 @@ class TestTapTypo(unittest.TestCase):
         )
         self.assertEqual(token, 'test')
 
-    @patch('tap_typo.typo.requests.post', new=mock_requests_post_get_token)
-    @patch('tap_typo.typo.requests.get', new=mock_requests_get_test_discover_mode)
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    def test_unauthorized_request(self):
+        '''
+        A request rejected with a 401 is retried with a new token, and concurrent requests
+        rejected with the same token share a single token request.
+        '''
+        tokens = iter(['new'])
+        barrier = threading.Barrier(4)
+
+        def mock_get(session, url, headers, params, timeout, stream=False):
+            if headers['Authorization'] == 'Bearer test':
+                barrier.wait(timeout=5)
+                return MockRequestResponse({'message': 'Unauthorized'}, 401)
+            return MockRequestResponse({'data': headers['Authorization']}, 200)
+
+        with patch('tap_typo.typo.requests.Session.get', new=mock_get), self.assertLogs(LOGGER, level='INFO'):
+            tap = TapTypo(config=generate_config(), catalog={'streams': []})
+            tap.get_token()
+            tap.token_manager.request_token = lambda: next(tokens)
+
+            results = []
+            threads = [
+                threading.Thread(target=lambda: results.append(tap.api_get_request('https://typo.ai/resource')[2]))
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(results, [{'data': 'Bearer new'}] * 4)
+
+    def test_token_cache(self):
+        '''
+        Tokens cached on disk are reused by the next runs until they expire.
+        '''
+        requested = []
+
+        def mock_post(session, url, headers, data, timeout):
+            requested.append(url)
+            return MockRequestResponse({'token': 'token-{}'.format(len(requested))}, 200)
+
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                patch('tap_typo.typo.requests.Session.post', new=mock_post), \
+                self.assertLogs(LOGGER, level='INFO'):
+            config = generate_config(token_cache_dir=cache_dir)
+
+            self.assertEqual(TapTypo(config=config, catalog={'streams': []}).get_token(), 'token-1')
+            self.assertEqual(TapTypo(config=config, catalog={'streams': []}).get_token(), 'token-1')
+            self.assertEqual(len(requested), 1)
+
+            cache_file = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+            self.assertEqual(os.stat(cache_file).st_mode & 0o777, 0o600)
+
+            # Expired
+            with open(cache_file, 'w', encoding='utf-8') as token_file:
+                json.dump({'token': 'token-1', 'expires_at': time.time() - 1}, token_file)
+            self.assertEqual(TapTypo(config=config, catalog={'streams': []}).get_token(), 'token-2')
+
+    def test_token_manager_expiry(self):
+        '''
+        JWT tokens are refreshed in the background before they expire and synchronously once they did.
+        '''
+        def jwt(expires_at):
+            payload = base64.urlsafe_b64encode(json.dumps({'exp': expires_at}).encode()).decode().rstrip('=')
+            return 'header.{}.signature'.format(payload)
+
+        now = int(time.time())
+        self.assertEqual(get_token_expiry(jwt(now + 600)), now + 600)
+        self.assertIsNone(get_token_expiry('opaque-token'))
+
+        tokens = iter([jwt(now + 30), jwt(now + 600), jwt(now + 1200)])
+        manager = TokenManager(lambda: next(tokens), refresh_margin=60)
+
+        expiring = manager.get_token()
+        # Still valid: returned while a new one is requested in the background
+        self.assertEqual(manager.get_token(), expiring)
+        manager.background_refresh.join()
+        self.assertEqual(manager.expires_at, now + 600)
+
+        manager.expires_at = now - 1
+        self.assertEqual(get_token_expiry(manager.get_token()), now + 1200)
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    @patch('tap_typo.typo.requests.Session.get', new=mock_requests_get_test_discover_mode)
     def test_discover_mode(self):
         '''
         tap-typo will fetch the schema from Typo and construct a catalog
@@ -120,8 +229,101 @@ class TestTapTypo(unittest.TestCase):
         self.assertEqual(len(log.output), 1)
         self.assertEqual(out, TEST_DISCOVER_MODE_OUTPUT)
 
-    @patch('tap_typo.typo.requests.post', new=mock_requests_post_get_token)
-    @patch('tap_typo.typo.requests.get', new=mock_requests_get_test_get_simple_audit_dataset)
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    def test_discover_paged_listing(self):
+        '''
+        Listings continue on the next page while their Link header has a next relation.
+        '''
+        def mock_get(session, url, headers, params, timeout, stream=False):
+            if url == 'https://typo.ai/audits':
+                return MockRequestResponse(generate_audit_listing_response(), 200, headers={'Link': '; rel="next"'})
+
+            if url == 'https://typo.ai/audits?page=2':
+                listing = generate_audit_listing_response()
+                listing['data'][0]['id'] = 124
+                return MockRequestResponse(listing, 200, headers={'Link': ''})
+
+            return mock_requests_get_test_discover_mode(session, url, headers, params, timeout, stream)
+
+        with patch('tap_typo.typo.requests.Session.get', new=mock_get), self.assertLogs(LOGGER, level='INFO'):
+            tap = TapTypo(config=generate_config())
+
+        self.assertEqual([stream['tap_stream_id'] for stream in tap.catalog['streams']], [
+            'tap-typo-mock_repository-mock_dataset',
+            'tap-typo-mock_repository-mock_dataset-audit-123',
+            'tap-typo-mock_repository-mock_dataset-audit-124'
+        ])
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    @patch('tap_typo.typo.requests.Session.get', new=mock_requests_get_test_discover_mode)
+    def test_incremental_discovery(self):
+        '''
+        Entries of a previous catalog are reused when their updated_at did not change,
+        rebuilt otherwise keeping their selection, and removed when no longer listed.
+        '''
+        with self.assertLogs(LOGGER, level='INFO') as log:
+            previous_catalog = TapTypo(config=generate_config()).catalog
+
+            dataset_entry, audit_entry = previous_catalog['streams']
+            dataset_entry['metadata'][0]['metadata']['selected'] = True
+            audit_entry['metadata'][0]['metadata']['selected'] = True
+            audit_entry['metadata'][0]['metadata']['updated-at'] = '2019-01-01T01:01:01.000Z'
+            audit_entry['schema']['properties'].pop('field_2')
+            previous_catalog['streams'].append({'tap_stream_id': 'tap-typo-mock_repository-removed', 'metadata': []})
+
+            tap = TapTypo(config=generate_config(incremental_discovery=True), catalog=previous_catalog)
+            catalog = tap.get_catalog()
+
+        self.assertIn('Incremental discovery: 1 entries reused, 1 rebuilt, 1 removed.', log.output[-1])
+        self.assertEqual(len(catalog['streams']), 2)
+        self.assertIs(catalog['streams'][0], dataset_entry)
+
+        rebuilt_entry = catalog['streams'][1]
+        self.assertIn('field_2', rebuilt_entry['schema']['properties'])
+        self.assertTrue(rebuilt_entry['metadata'][0]['metadata']['selected'])
+        self.assertEqual(rebuilt_entry['metadata'][0]['metadata']['updated-at'], '2020-01-01T01:01:01.000Z')
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    def test_discovery_cache(self):
+        '''
+        Discovery listings are cached on disk: fresh listings are reused without requests and
+        stale listings are revalidated with their ETag.
+        '''
+        requested = []
+
+        def mock_get(session, url, headers, params, timeout, stream=False):
+            requested.append(url)
+            if headers.get('If-None-Match') == '"v1"':
+                return MockRequestResponse(None, 304, headers={'ETag': '"v1"'})
+            response = mock_requests_get_test_discover_mode(session, url, headers, params, timeout, stream)
+            response.headers['ETag'] = '"v1"'
+            return response
+
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                patch('tap_typo.typo.requests.Session.get', new=mock_get), \
+                patch('sys.stdout', new=StringIO()) as mock_stdout, \
+                self.assertLogs(LOGGER, level='INFO'):
+            # Cold start, discover mode only lists once
+            tap = TapTypo(config=generate_config(discovery_cache_dir=cache_dir))
+            tap.discover()
+            self.assertEqual(requested, ['https://typo.ai/datasets', 'https://typo.ai/audits'])
+
+            # Warm start
+            tap = TapTypo(config=generate_config(discovery_cache_dir=cache_dir))
+            tap.discover()
+            self.assertEqual(len(requested), 2)
+
+            # Expired cache, revalidated
+            tap = TapTypo(config=generate_config(discovery_cache_dir=cache_dir, discovery_cache_ttl=0))
+            tap.discover()
+            self.assertEqual(len(requested), 4)
+
+            out = mock_stdout.getvalue()
+
+        self.assertEqual(out, TEST_DISCOVER_MODE_OUTPUT * 3)
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    @patch('tap_typo.typo.requests.Session.get', new=mock_requests_get_test_get_simple_audit_dataset)
     def test_get_simple_audit_dataset(self):
         '''
         Fetch a simple dataset with 2 records from Typo
@@ -135,8 +337,8 @@ class TestTapTypo(unittest.TestCase):
         self.assertEqual(len(log.output), 4)
         self.assertEqual(out, TEST_GET_SIMPLE_AUDIT_DATASET_OUTPUT)
 
-    @patch('tap_typo.typo.requests.post', new=mock_requests_post_get_token)
-    @patch('tap_typo.typo.requests.get', new=mock_requests_get_test_get_simple_streaming_dataset)
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    @patch('tap_typo.typo.requests.Session.get', new=mock_requests_get_test_get_simple_streaming_dataset)
     def test_get_simple_streaming_dataset(self):
         '''
         Fetch a simple dataset with 2 records from Typo
@@ -150,8 +352,65 @@ class TestTapTypo(unittest.TestCase):
         self.assertEqual(len(log.output), 4)
         self.assertEqual(out, TEST_GET_SIMPLE_STREAMING_DATASET_OUTPUT)
 
-    @patch('tap_typo.typo.requests.post', new=mock_requests_post_get_token)
-    @patch('tap_typo.typo.requests.get', new=mock_requests_get_test_multi_page_no_limit)
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    def test_lazy_catalog(self):
+        '''
+        Sync the configured stream without discovering the whole catalog.
+        '''
+        requested = []
+
+        def mock_get(session, url, headers, params, timeout, stream=False):
+            requested.append(url)
+            return mock_requests_get_test_get_simple_streaming_dataset(session, url, headers, params, timeout, stream)
+
+        out = None
+        with patch('tap_typo.typo.requests.Session.get', new=mock_get), \
+                patch('sys.stdout', new=StringIO()) as mock_stdout, \
+                self.assertLogs(LOGGER, level='INFO') as log:
+            tap = TapTypo(config=generate_config(audit_id=None), lazy_catalog=True)
+            tap.sync()
+            out = mock_stdout.getvalue()
+
+        self.assertEqual(len(log.output), 4)
+        self.assertEqual(out, TEST_GET_SIMPLE_STREAMING_DATASET_OUTPUT)
+        self.assertNotIn('https://typo.ai/datasets', requested)
+        self.assertNotIn('https://typo.ai/audits', requested)
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    def test_lazy_catalog_without_results(self):
+        '''
+        A stream that discovery would leave out is not synced without discovery either:
+        an audit whose information says it is still running, a dataset whose information has no models.
+        '''
+        def sync_without_results(audit_id, response):
+            requested = []
+
+            def mock_get(session, url, headers, params, timeout, stream=False):
+                requested.append(url)
+                return MockRequestResponse(response, 200)
+
+            with patch('tap_typo.typo.requests.Session.get', new=mock_get), \
+                    patch('sys.stdout', new=StringIO()) as mock_stdout, \
+                    self.assertLogs(LOGGER, level='INFO') as log:
+                tap = TapTypo(config=generate_config(audit_id=audit_id), lazy_catalog=True)
+                tap.sync()
+
+            self.assertEqual(mock_stdout.getvalue(), '')
+            self.assertIn('Nothing do to. Cannot find a stream', log.output[-1])
+            return requested
+
+        response = generate_audit_dataset_header_response()
+        response['data']['state'] = 'RUNNING'
+        self.assertEqual(sync_without_results('123', response),
+                         ['https://typo.ai/repositories/mock_repository/datasets/mock_dataset/audits/123'])
+
+        response = generate_streaming_dataset_header_response()
+        response['data']['models'] = []
+        self.assertEqual(sync_without_results(None, response),
+                         ['https://typo.ai/repositories/mock_repository/datasets/mock_dataset'])
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    @patch('tap_typo.typo.requests.Session.get', new=mock_requests_get_test_multi_page_no_limit)
     def test_multi_page_no_limit(self):
         '''
         Fetch two pages of a dataset until records end.
@@ -165,8 +424,667 @@ class TestTapTypo(unittest.TestCase):
         self.assertEqual(len(log.output), 5)
         self.assertEqual(out, TEST_MULTI_PAGE_NO_LIMIT_OUTPUT)
 
-    @patch('tap_typo.typo.requests.post', new=mock_requests_post_get_token)
-    @patch('tap_typo.typo.requests.get', new=mock_requests_get_test_resume_with_state)
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    @patch('tap_typo.typo.requests.Session.get', new=mock_requests_get_test_multi_page_no_limit)
+    def test_multi_page_prefetch(self):
+        '''
+        Fetch two pages of a dataset with pages prefetched in the background.
+        Output must be the same as when fetching pages one at a time.
+        '''
+        out = None
+        with patch('sys.stdout', new=StringIO()) as mock_stdout, self.assertLogs(LOGGER, level='INFO') as log:
+            tap = TapTypo(config=generate_config(records_per_page=2, prefetch_pages=2))
+            tap.sync()
+            out = mock_stdout.getvalue()
+
+        self.assertEqual(len(log.output), 5)
+        self.assertEqual(out, TEST_MULTI_PAGE_NO_LIMIT_OUTPUT)
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    def test_transform_processes(self):
+        '''
+        Fetch two pages of a dataset with records rendered by worker processes.
+        Output must be the same as when rendering records in the tap's process.
+        With page numbers, the second page is fetched while the first one is rendered,
+        but not when the record limit is within the first page.
+        '''
+        requested = []
+
+        def mock_get(session, url, headers, params, timeout, stream=False):
+            if 'results' in url:
+                requested.append((url[-1], '"type": "RECORD"' in mock_stdout.getvalue()))
+            return mock_requests_get_test_multi_page_no_limit(session, url, headers, params, timeout, stream)
+
+        out = None
+        with patch('tap_typo.typo.requests.Session.get', new=mock_get), \
+                patch('sys.stdout', new=StringIO()) as mock_stdout, \
+                self.assertLogs(LOGGER, level='INFO') as log:
+            tap = TapTypo(config=generate_config(records_per_page=2, transform_processes=2))
+            tap.sync()
+            out = mock_stdout.getvalue()
+
+        self.assertEqual(len(log.output), 5)
+        self.assertEqual(out, TEST_MULTI_PAGE_NO_LIMIT_OUTPUT)
+        self.assertIsNone(tap.render_pool)
+        # No record was written yet when the second page was requested
+        self.assertEqual(requested, [('1', False), ('2', False)])
+
+        outputs = []
+        for transform_processes in [0, 2]:
+            requested.clear()
+            with patch('tap_typo.typo.requests.Session.get', new=mock_get), \
+                    patch('sys.stdout', new=StringIO()) as mock_stdout, \
+                    self.assertLogs(LOGGER, level='INFO'):
+                tap = TapTypo(config=generate_config(
+                    records_per_page=2, record_limit=2, transform_processes=transform_processes))
+                tap.sync()
+                outputs.append(mock_stdout.getvalue())
+
+            self.assertEqual([page for page, _ in requested], ['1'])
+        self.assertEqual(outputs[1], outputs[0])
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    def test_checkpoint(self):
+        '''
+        The last written STATE is checkpointed at the end of every page and a crashed sync
+        resumes from it.
+        '''
+        def mock_get(session, url, headers, params, timeout, stream=False):
+            if url.endswith('page=2'):
+                raise Exception('Crash')
+            return mock_requests_get_test_multi_page_no_limit(session, url, headers, params, timeout, stream)
+
+        with tempfile.TemporaryDirectory() as checkpoint_dir, \
+                patch('sys.stdout', new=StringIO()) as mock_stdout, \
+                self.assertLogs(LOGGER, level='INFO') as log:
+            config = generate_config(
+                records_per_page=2, checkpoint_file=os.path.join(checkpoint_dir, 'checkpoint.json'))
+
+            with patch('tap_typo.typo.requests.Session.get', new=mock_get), self.assertRaises(Exception):
+                TapTypo(config=config).sync()
+
+            bookmark = {'bookmarks': {'tap-typo-mock_repository-mock_dataset-audit-123': {'__typo_record_id': 2}}}
+            self.assertEqual(load_checkpoint(config['checkpoint_file']), bookmark)
+            self.assertEqual(mock_stdout.getvalue().splitlines()[-1], json.dumps({'type': 'STATE', 'value': bookmark}))
+
+            # A provided state that is behind the checkpoint is moved forward
+            with patch('tap_typo.typo.requests.Session.get', new=mock_requests_get_test_resume_with_state):
+                tap = TapTypo(config=config, state={'bookmarks': {'tap-typo-mock_repository-mock_dataset-audit-123': {
+                    '__typo_record_id': 1}}}, resume_from_checkpoint=True)
+
+        self.assertTrue(any('Resuming from checkpoint' in line for line in log.output))
+        self.assertEqual(tap.state, bookmark)
+
+    def test_checkpoint_full_queue(self):
+        '''
+        Parallel streams that keep the output queue full are still checkpointed every few STATE
+        messages and once the checkpoint's interval went by.
+        '''
+        def drain(checkpoint, checkpoint_every_states):
+            writer = QueuedMessageWriter(checkpoint=checkpoint, checkpoint_every_states=checkpoint_every_states)
+            for record_id in range(1, 6):
+                writer.write_record('stream', {'id': record_id})
+                writer.write_state({'bookmarks': {'stream': {'__typo_record_id': record_id}}})
+
+            saved = []
+            with patch('tap_typo.checkpoint.write_atomically', new=lambda path, data, durable: saved.append(data)), \
+                    patch('sys.stdout', new=StringIO()):
+                writer.drain([])
+
+            return [json.loads(line)['value']['bookmarks']['stream']['__typo_record_id'] for line in saved]
+
+        self.assertEqual(drain(Checkpoint('checkpoint.json'), 2), [2, 4, 5])
+
+        # Not saved again when the queue empties, less than a minute later
+        checkpoint = Checkpoint('checkpoint.json', every_seconds=60)
+        checkpoint.saved_at = time.monotonic() - 60
+        self.assertEqual(drain(checkpoint, 100), [1])
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    @patch('tap_typo.typo.requests.Session.get', new=mock_requests_get_test_multi_page_no_limit)
+    def test_state_every_page(self):
+        '''
+        Output STATE messages at page boundaries instead of after every record.
+        Setting state_every_page alone turns off the default STATE message per record.
+        '''
+        out = None
+        with patch('sys.stdout', new=StringIO()) as mock_stdout, self.assertLogs(LOGGER, level='INFO'):
+            tap = TapTypo(config=generate_config(records_per_page=2, state_every_page=True))
+            tap.sync()
+            out = mock_stdout.getvalue()
+
+        # Same output without the STATE messages of records 1 and 3
+        expected_lines = TEST_MULTI_PAGE_NO_LIMIT_OUTPUT.splitlines(keepends=True)
+        del expected_lines[7]
+        del expected_lines[3]
+
+        self.assertEqual(out, ''.join(expected_lines))
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    @patch('tap_typo.typo.requests.Session.get', new=mock_requests_get_test_multi_page_no_limit)
+    def test_state_final_on_record_limit(self):
+        '''
+        Output a final STATE message when stopping on the record limit between two emissions.
+        '''
+        out = None
+        with patch('sys.stdout', new=StringIO()) as mock_stdout, self.assertLogs(LOGGER, level='INFO'):
+            tap = TapTypo(config=generate_config(records_per_page=2, record_limit=3, state_every_records=10))
+            tap.sync()
+            out = mock_stdout.getvalue()
+
+        expected_lines = TEST_MULTI_PAGE_NO_LIMIT_OUTPUT.splitlines(keepends=True)
+        # Records 1 to 3 followed by the STATE message of record 3
+        expected = ''.join(expected_lines[:3] + expected_lines[4:5] + expected_lines[6:8])
+
+        self.assertEqual(out, expected)
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    @patch('tap_typo.typo.requests.Session.get', new=mock_requests_get_test_multi_page_no_limit)
+    def test_multi_page_streamed_records(self):
+        '''
+        Fetch two pages of a dataset parsing records incrementally from the responses.
+        '''
+        out = None
+        with patch('sys.stdout', new=StringIO()) as mock_stdout, self.assertLogs(LOGGER, level='INFO') as log:
+            tap = TapTypo(config=generate_config(records_per_page=2, stream_records=True))
+            tap.sync()
+            out = mock_stdout.getvalue()
+
+        self.assertEqual(len(log.output), 5)
+        self.assertEqual(out, TEST_MULTI_PAGE_NO_LIMIT_OUTPUT)
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    def test_streamed_records_read_error(self):
+        '''
+        Resume a streamed page interrupted by a read error after the last record written.
+        '''
+        results_url = 'https://typo.ai/repositories/mock_repository/datasets/mock_dataset/audits/123/results'
+        first_page = generate_audit_dataset_response([generate_record(1), generate_record(2)])
+        # The body is cut right after the first record
+        first_record = json.dumps(first_page['data']['records'][0]).encode('utf-8')
+        read_error_after = json.dumps(first_page).encode('utf-8').index(first_record) + len(first_record)
+        requested = []
+
+        def mock_get(session, url, headers, params, timeout, stream=False):
+            requested.append(url)
+
+            if url == results_url + '?records_per_page=2&page=1':
+                return MockRequestResponse(
+                    first_page, 200, headers={'Link': '; rel="next"'}, read_error_after=read_error_after)
+
+            if url == results_url + '?records_per_page=2&page=1&__typo_id=gt:1':
+                return MockRequestResponse(
+                    generate_audit_dataset_response([generate_record(2), generate_record(3)]),
+                    200, headers={'Link': '; rel="next"'})
+
+            if url == results_url + '?records_per_page=2&page=2&__typo_id=gt:1':
+                return MockRequestResponse(generate_audit_dataset_response([generate_record(4)]), 200)
+
+            return mock_requests_get_test_discover_mode(session, url, headers, params, timeout, stream)
+
+        with patch('tap_typo.typo.requests.Session.get', new=mock_get), \
+                patch('sys.stdout', new=StringIO()) as mock_stdout, self.assertLogs(LOGGER, level='INFO') as log:
+            tap = TapTypo(config=generate_config(records_per_page=2, stream_records=True, retry_base_delay=0))
+            tap.sync()
+            out = mock_stdout.getvalue()
+
+        messages = [json.loads(line) for line in out.splitlines()]
+        record_ids = [message['record']['__typo_record_id'] for message in messages if message['type'] == 'RECORD']
+        self.assertEqual(record_ids, [1, 2, 3, 4])
+        self.assertEqual(tap.state['bookmarks']['tap-typo-mock_repository-mock_dataset-audit-123'],
+                         {'__typo_record_id': 4})
+        self.assertIn(results_url + '?records_per_page=2&page=1&__typo_id=gt:1', requested)
+        self.assertTrue(any('Results page interrupted after 1 records' in line for line in log.output))
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    @patch('tap_typo.typo.requests.Session.get', new=mock_requests_get_test_get_simple_audit_dataset)
+    def test_field_selection(self):
+        '''
+        Deselected fields are left out of the SCHEMA and RECORD messages.
+        The Typo properties cannot be deselected.
+        '''
+        out = None
+        with patch('sys.stdout', new=StringIO()) as mock_stdout, self.assertLogs(LOGGER, level='INFO'):
+            catalog = TapTypo(config=generate_config()).catalog
+            stream = catalog['streams'][1]
+            stream['schema']['properties']['typo'] = {'type': ['null', 'string']}
+            stream['metadata'].append({
+                'breadcrumb': ['properties', 'typo'],
+                'metadata': {'inclusion': 'available', 'selected': False}
+            })
+            for field_metadata in stream['metadata']:
+                if not field_metadata['breadcrumb']:
+                    field_metadata['metadata']['selected'] = True
+                elif field_metadata['breadcrumb'][1] in ('field_1', '__typo_result'):
+                    field_metadata['metadata']['selected'] = False
+
+            tap = TapTypo(config=generate_config(), catalog=catalog)
+            tap.sync(catalog_mode=True)
+            out = mock_stdout.getvalue()
+
+        expected = TEST_GET_SIMPLE_AUDIT_DATASET_OUTPUT.replace(
+            '"field_1": {"type": ["null", "integer"]}, ', '').replace('"typo": "tap", ', '')
+        self.assertEqual(out, expected)
+
+    def test_catalog_index(self):
+        '''
+        Streams are looked up by tap_stream_id and their selection read from the indexed metadata.
+        '''
+        catalog = json.loads(TEST_DISCOVER_MODE_OUTPUT)
+        dataset_entry, audit_entry = catalog['streams']
+        audit_entry['metadata'][0]['metadata']['selected'] = True
+        audit_entry['metadata'].append({
+            'breadcrumb': ['properties', 'created'],
+            'metadata': {'inclusion': 'available', 'selected': False, 'datetime-format': '%Y'}
+        })
+        audit_entry['metadata'].append({
+            'breadcrumb': ['properties', 'updated'],
+            'metadata': {'inclusion': 'available', 'datetime-format': '%Y-%m'}
+        })
+        # As in catalogs made before the Typo properties were marked automatic
+        audit_entry['metadata'].append({
+            'breadcrumb': ['properties', '__typo_result'],
+            'metadata': {'inclusion': 'available', 'selected': False}
+        })
+
+        index = CatalogIndex(catalog)
+
+        self.assertIs(index.get_stream(audit_entry['tap_stream_id']), audit_entry)
+        self.assertIsNone(index.get_stream('tap-typo-unknown'))
+        self.assertFalse(index.is_selected(dataset_entry['tap_stream_id']))
+        self.assertTrue(index.is_selected(audit_entry['tap_stream_id']))
+        self.assertEqual(index.get_stream_metadata(audit_entry['tap_stream_id'], 'audit_id'), 123)
+
+        excluded_fields = index.get_excluded_fields(audit_entry['tap_stream_id'])
+        self.assertEqual(excluded_fields, {'created'})
+        self.assertEqual(
+            index.get_datetime_formats(audit_entry['tap_stream_id'], excluded_fields), {'updated': '%Y-%m'})
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    @patch('tap_typo.typo.requests.Session.get', new=mock_requests_get_test_keyset_pagination)
+    def test_keyset_pagination(self):
+        '''
+        Fetch every page as the first page after the last record id seen, until a short page.
+        '''
+        out = None
+        with patch('sys.stdout', new=StringIO()) as mock_stdout, self.assertLogs(LOGGER, level='INFO') as log:
+            tap = TapTypo(config=generate_config(records_per_page=2, pagination='keyset'))
+            tap.sync()
+            out = mock_stdout.getvalue()
+
+        # Discovery, sync start, 3 pages and sync end
+        self.assertEqual(len(log.output), 6)
+
+        expected_lines = TEST_MULTI_PAGE_NO_LIMIT_OUTPUT.splitlines(keepends=True)
+        expected_lines += [
+            '{"type": "RECORD", "stream": "tap-typo-mock_repository-mock_dataset-audit-123", "record": {"date": "today", "typo": "tap", "__typo_result": "OK", "__typo_record_id": 5}}\n',  # noqa pylint: disable=line-too-long
+            '{"type": "STATE", "value": {"bookmarks": {"tap-typo-mock_repository-mock_dataset-audit-123": {"__typo_record_id": 5}}}}\n'  # noqa pylint: disable=line-too-long
+        ]
+        self.assertEqual(out, ''.join(expected_lines))
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    def test_id_range_shards(self):
+        '''
+        Fetch the record id ranges of a stream in parallel.
+
+        Verified on this test:
+        - Records are output in id order, including the ones past the estimated last id.
+        - Bookmarks only move forward.
+        - Each range after the first starts after the last id of the previous one.
+        '''
+        results_url = 'https://typo.ai/repositories/mock_repository/datasets/mock_dataset/audits/123/results'
+        requested_ids = []
+
+        def mock_get(session, url, headers, params, timeout, stream=False):
+            if url.startswith(results_url):
+                # Keyset pages of records 1 to 13
+                after_id = int(url.split('gt:')[1]) if 'gt:' in url else 0
+                requested_ids.append(after_id)
+                record_ids = range(after_id + 1, min(after_id + 2, 13) + 1)
+                return MockRequestResponse(
+                    generate_audit_dataset_response([generate_record(record_id) for record_id in record_ids]),
+                    200, headers={'Link': '; rel="next"'})
+
+            return mock_requests_get_test_discover_mode(session, url, headers, params, timeout, stream)
+
+        with patch('tap_typo.typo.requests.Session.get', new=mock_get), self.assertLogs(LOGGER, level='INFO'):
+            catalog = TapTypo(config=generate_config()).catalog
+            for stream in catalog['streams']:
+                # Fewer records than there are
+                stream['metadata'][0]['metadata']['row-count'] = 12
+
+        # Pages rendered by the tap, then by worker processes
+        for transform_processes in [0, 2]:
+            with patch('tap_typo.typo.requests.Session.get', new=mock_get), \
+                    patch('sys.stdout', new=StringIO()) as mock_stdout, self.assertLogs(LOGGER, level='INFO') as log:
+                tap = TapTypo(config=generate_config(
+                    records_per_page=2, pagination='keyset', id_range_shards=3,
+                    transform_processes=transform_processes), catalog=catalog)
+                tap.sync()
+                out = mock_stdout.getvalue()
+
+            self.assertTrue(any(
+                'Fetching stream `tap-typo-mock_repository-mock_dataset-audit-123` in 3 Typo record id ranges.' in line
+                for line in log.output))
+
+            messages = [json.loads(line) for line in out.splitlines()]
+            record_ids = [
+                message['record']['__typo_record_id'] for message in messages if message['type'] == 'RECORD']
+            self.assertEqual(record_ids, list(range(1, 14)))
+
+            bookmarks = [
+                message['value']['bookmarks']['tap-typo-mock_repository-mock_dataset-audit-123']['__typo_record_id']
+                for message in messages if message['type'] == 'STATE' and message['value']
+            ]
+            self.assertEqual(bookmarks, sorted(bookmarks))
+            self.assertEqual(bookmarks[-1], 13)
+
+        self.assertIn(4, requested_ids)
+        self.assertIn(8, requested_ids)
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    def test_adaptive_page_size(self):
+        '''
+        Page sizes grow while pages are fast and shrink on timeouts before any backoff retry.
+        '''
+        requested = []
+
+        def mock_get(session, url, headers, params, timeout, stream=False):
+            requested.append(url)
+            if 'records_per_page=4' in url:
+                raise requests.exceptions.Timeout()
+            return mock_requests_get_test_keyset_pagination(session, url, headers, params, timeout, stream)
+
+        out = None
+        with patch('tap_typo.typo.requests.Session.get', new=mock_get), \
+                patch('sys.stdout', new=StringIO()) as mock_stdout, \
+                self.assertLogs(LOGGER, level='INFO') as log:
+            tap = TapTypo(config=generate_config(
+                records_per_page=2, adaptive_page_size=True, min_records_per_page=2, max_records_per_page=4))
+            tap.sync()
+            out = mock_stdout.getvalue()
+
+        self.assertIn('adaptive_page_size requires keyset pagination', log.output[0])
+        self.assertEqual(len([line for line in log.output if 'Retrying with 2 records per page' in line]), 2)
+        self.assertEqual(len(requested), 7)
+        self.assertEqual(len([line for line in out.splitlines() if '"type": "RECORD"' in line]), 5)
+
+        # Connection errors are still retried while the page size can shrink
+        requested = []
+        failures = []
+
+        def mock_get_connection_error(session, url, headers, params, timeout, stream=False):
+            requested.append(url)
+            if 'records_per_page=2' in url and not failures:
+                failures.append(url)
+                raise requests.exceptions.ConnectionError('Connection reset by peer')
+            return mock_requests_get_test_keyset_pagination(session, url, headers, params, timeout, stream)
+
+        with patch('tap_typo.typo.requests.Session.get', new=mock_get_connection_error), \
+                patch('backoff._sync.time.sleep'), \
+                patch('sys.stdout', new=StringIO()) as mock_stdout:
+            tap = TapTypo(config=generate_config(
+                records_per_page=2, adaptive_page_size=True, min_records_per_page=1, max_records_per_page=2))
+            tap.sync()
+            out = mock_stdout.getvalue()
+
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(requested.count(failures[0]), 2)
+        self.assertEqual(len([line for line in out.splitlines() if '"type": "RECORD"' in line]), 5)
+
+        page_size = AdaptivePageSize(100, minimum=10, maximum=1000, target_seconds=5, max_page_bytes=50000)
+        page_size.page_fetched(100, 1)
+        self.assertEqual(page_size.size, 200)
+        page_size.page_fetched(200, 10)
+        self.assertEqual(page_size.size, 100)
+        page_size.page_fetched(50, 0.1)
+        self.assertEqual(page_size.size, 100)
+        page_size.page_fetched(100, 1, size_bytes=100 * 1000)
+        self.assertEqual(page_size.size, 50)
+        self.assertTrue(page_size.timed_out())
+        self.assertEqual(page_size.size, 25)
+        page_size.size = 10
+        self.assertFalse(page_size.timed_out())
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    def test_rate_limited_request(self):
+        '''
+        Requests rejected with a 429 are sent again after the Retry-After delay.
+        '''
+        rejected = []
+
+        def mock_get(session, url, headers, params, timeout, stream=False):
+            if 'results' in url and url not in rejected:
+                rejected.append(url)
+                return MockRequestResponse({'message': 'Too Many Requests'}, 429, headers={'Retry-After': '0'})
+            return mock_requests_get_test_get_simple_audit_dataset(session, url, headers, params, timeout, stream)
+
+        out = None
+        with patch('tap_typo.typo.requests.Session.get', new=mock_get), \
+                patch('sys.stdout', new=StringIO()) as mock_stdout, \
+                self.assertLogs(LOGGER, level='INFO') as log:
+            tap = TapTypo(config=generate_config(max_requests_per_second=100, max_concurrent_requests=2))
+            tap.sync()
+            out = mock_stdout.getvalue()
+
+        self.assertEqual(len(rejected), 1)
+        self.assertEqual(len([line for line in log.output if 'Typo answered with status 429' in line]), 1)
+        self.assertEqual(out, TEST_GET_SIMPLE_AUDIT_DATASET_OUTPUT)
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    def test_retry_policy(self):
+        '''
+        Server errors are retried and counted, other client errors fail at once.
+        '''
+        requested = []
+
+        def mock_get(session, url, headers, params, timeout, stream=False):
+            requested.append(url)
+            if 'results' in url and requested.count(url) <= 2:
+                return MockRequestResponse({'message': 'Bad Gateway'}, 502)
+            if url == 'https://typo.ai/missing':
+                return MockRequestResponse({'message': 'Not Found'}, 404)
+            return mock_requests_get_test_get_simple_audit_dataset(session, url, headers, params, timeout, stream)
+
+        out = None
+        with patch('tap_typo.typo.requests.Session.get', new=mock_get), \
+                patch('sys.stdout', new=StringIO()) as mock_stdout, \
+                self.assertLogs(LOGGER, level='INFO') as log:
+            tap = TapTypo(config=generate_config(retry_base_delay=0))
+            tap.sync()
+            out = mock_stdout.getvalue()
+
+            self.assertEqual(out, TEST_GET_SIMPLE_AUDIT_DATASET_OUTPUT)
+            self.assertEqual(tap.retry_policy.counts, {'502': 2})
+            self.assertIn('Retried requests: 502 x2.', log.output[-1])
+
+            requested.clear()
+            with self.assertRaises(SystemExit):
+                tap.api_get_request('https://typo.ai/missing')
+            self.assertEqual(requested, ['https://typo.ai/missing'])
+
+        policy = RetryPolicy(max_retries=3, base_delay=1, max_delay=2, deadline=10)
+        self.assertTrue(policy.is_retryable(503))
+        self.assertFalse(policy.is_retryable(400))
+        self.assertLessEqual(policy.get_delay(5), 2)
+        self.assertEqual(policy.get_delay(1, retry_after=7), 7)
+        self.assertTrue(policy.should_retry(3, time.monotonic(), 5))
+        self.assertFalse(policy.should_retry(4, time.monotonic(), 0))
+        self.assertFalse(policy.should_retry(1, time.monotonic() - 8, 5))
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    def test_html_error_response(self):
+        '''
+        Errors with an HTML body, as sent by gateways, are logged with their text before exiting.
+        '''
+        class MockHtmlResponse(MockRequestResponse):  # pylint: disable=too-few-public-methods
+            def json(self):
+                return json.loads(self.text)
+
+        requested = []
+
+        def mock_get(session, url, headers, params, timeout, stream=False):
+            requested.append(url)
+            status = 502 if 'results' in url else 404
+            response = MockHtmlResponse(None, status)
+            response.text = '<html><body><h1>{}</h1></body></html>'.format(status)
+            return response
+
+        with patch('tap_typo.typo.requests.Session.get', new=mock_get), \
+                self.assertLogs(LOGGER, level='INFO') as log:
+            tap = TapTypo(config=generate_config(max_retries=1, retry_base_delay=0), catalog={'streams': []})
+            results_url = 'https://typo.ai/repositories/mock_repository/datasets/mock_dataset/audits/123/results'
+            with self.assertRaises(SystemExit):
+                tap.api_get_request(results_url)
+            self.assertEqual(requested, [results_url, results_url])
+            self.assertIn('request.status_code=[502], response.text=[<html><body><h1>502</h1></body></html>]',
+                          log.output[-1])
+
+            with self.assertRaises(SystemExit):
+                tap.api_get_request('https://typo.ai/missing')
+            self.assertIn('request.status_code=[404], response.text=[<html><body><h1>404</h1></body></html>]',
+                          log.output[-1])
+
+    def test_rate_limiter(self):
+        '''
+        The rate limiter spaces requests out, bounds concurrent requests and pauses when asked by the server.
+        '''
+        self.assertEqual(get_retry_after({'Retry-After': '3'}), 3)
+        self.assertIsNone(get_retry_after({}))
+        self.assertEqual(get_rate_limit_reset({'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '2'}), 2)
+        self.assertIsNone(get_rate_limit_reset({'X-RateLimit-Remaining': '5', 'X-RateLimit-Reset': '2'}))
+        self.assertAlmostEqual(
+            get_rate_limit_reset({'RateLimit-Remaining': '0', 'RateLimit-Reset': str(time.time() + 60)}), 60, delta=1)
+
+        limiter = RateLimiter(rate=20, burst=1)
+        started = time.monotonic()
+        for _ in range(3):
+            with limiter:
+                pass
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+        limiter = RateLimiter(max_concurrency=2)
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+
+        def request():
+            with limiter:
+                with lock:
+                    in_flight.append(1)
+                    peak.append(len(in_flight))
+                time.sleep(0.01)
+                with lock:
+                    in_flight.pop()
+
+        threads = [threading.Thread(target=request) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max(peak), 2)
+
+        limiter.update({'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '0.05'})
+        started = time.monotonic()
+        with limiter:
+            pass
+        self.assertGreaterEqual(time.monotonic() - started, 0.04)
+
+    def test_schema_compiler(self):
+        '''
+        Identical Typo schemas must be compiled once, each call still returning its own schema properties.
+        '''
+        def typo_schema():
+            return {
+                'id': {'type': 'int', 'primary': True},
+                'price': {'type': 'float'},
+                'created': {'type': 'date-time', 'format': '%Y-%m-%d'},
+                'other': {}
+            }
+
+        compiler = SchemaCompiler(output_rfc3339_datetime=True)
+
+        first = compiler.compile(typo_schema())
+        second = compiler.compile(typo_schema())
+
+        self.assertEqual(len(compiler.compiled), 1)
+        self.assertEqual(first, compile_schema(typo_schema(), output_rfc3339_datetime=True))
+        self.assertEqual(first, second)
+        self.assertIsNot(first[1]['properties'], second[1]['properties'])
+        self.assertEqual(first[0], ['__typo_record_id', 'id'])
+        self.assertEqual(first[1]['properties']['created'], {'type': ['null', 'string'], 'format': 'date-time'})
+        self.assertEqual(first[3], {'created': '%Y-%m-%d'})
+
+        reordered = dict(reversed(list(typo_schema().items())))
+        compiler.compile(reordered)
+        self.assertEqual(len(compiler.compiled), 2)
+
+    def test_datetime_converter(self):
+        '''
+        DatetimeConverter must convert values exactly as strptime followed by rfc3339 does,
+        record by record and a page at a time.
+        '''
+        fields_format = {
+            'created': '%Y-%m-%d %H:%M:%S',
+            'updated': '%Y-%m-%d %H:%M:%S',
+            'day': '%d/%m/%Y',
+            'precise': '%Y-%m-%dT%H:%M:%S.%f'
+        }
+        records = [
+            {'created': '2020-01-02 03:04:05', 'updated': '2020-1-2 3:04:05', 'day': '31/12/1999',
+             'precise': '2020-01-02T03:04:05.123'},
+            {'created': '2020-01-02 03:04:05', 'updated': '2020-02-29 23:59:59', 'day': '1/1/2000',
+             'precise': '2020-01-02T03:04:05.123456'}
+        ]
+        expected = [
+            {field: rfc3339(datetime.strptime(value, fields_format[field])) for field, value in record.items()}
+            for record in records
+        ]
+
+        converter = DatetimeConverter(fields_format)
+
+        by_record = [dict(record) for record in records]
+        for record in by_record:
+            converter.convert_record(record)
+        self.assertEqual(by_record, expected)
+
+        by_page = [dict(record) for record in records]
+        converter.convert_records(by_page)
+        self.assertEqual(by_page, expected)
+
+        with self.assertRaises(ValueError):
+            converter.convert_record({'created': '2020-02-30 00:00:00', 'updated': '2020-01-01 00:00:00',
+                                      'day': '01/01/2000', 'precise': '2020-01-02T03:04:05.1'})
+
+    def test_record_rendering(self):
+        '''
+        Records rendered by MessageWriter must be identical to singer.write_record output.
+        '''
+        record = {
+            'text': 'caf\u00e9 "quoted" \\ \n',
+            'float': 0.1,
+            'big': 12345678901234567890,
+            'none': None,
+            'flag': True,
+            'nested': {'list': [1, 2.5, 'x']},
+            '__typo_result': 'OK',
+            '__typo_record_id': 1
+        }
+
+        with patch('sys.stdout', new=StringIO()) as mock_stdout:
+            singer.write_record('tap-typo-repository-dataset', record)
+            expected = mock_stdout.getvalue()
+
+        with patch('sys.stdout', new=StringIO()) as mock_stdout:
+            writer = MessageWriter()
+            writer.write_record('tap-typo-repository-dataset', record)
+            writer.flush()
+            out = mock_stdout.getvalue()
+
+        self.assertEqual(out, expected)
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    @patch('tap_typo.typo.requests.Session.get', new=mock_requests_get_test_resume_with_state)
     def test_resume_with_state(self):
         '''
         Resume sync by providing state input
@@ -188,6 +1106,179 @@ class TestTapTypo(unittest.TestCase):
         self.assertEqual(len(log.output), 4)
         self.assertEqual(out, TEST_RESUME_WITH_STATE_OUTPUT)
 
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    @patch('tap_typo.typo.requests.Session.get', new=mock_requests_get_test_parallel_streams)
+    def test_parallel_streams(self):
+        '''
+        Sync two catalog streams at once.
+
+        Verified on this test:
+        - Every stream outputs its SCHEMA before its records, and its records in order.
+        - STATE messages merge the bookmarks of all the streams.
+        '''
+        audit_stream_id = 'tap-typo-mock_repository-mock_dataset-audit-123'
+        dataset_stream_id = 'tap-typo-mock_repository-mock_dataset'
+
+        out = None
+        with patch('sys.stdout', new=StringIO()) as mock_stdout, self.assertLogs(LOGGER, level='INFO'):
+            catalog = TapTypo(config=generate_config()).catalog
+            for stream in catalog['streams']:
+                stream['metadata'][0]['metadata']['selected'] = True
+
+            tap = TapTypo(config=generate_config(records_per_page=2, max_parallel_streams=2), catalog=catalog)
+            tap.sync(catalog_mode=True)
+            out = mock_stdout.getvalue()
+
+        messages = [json.loads(line) for line in out.splitlines()]
+
+        for stream_id, record_ids in [(audit_stream_id, [1, 2, 3, 4]), (dataset_stream_id, [1, 2])]:
+            stream_messages = [message for message in messages if message.get('stream') == stream_id]
+            self.assertEqual(stream_messages[0]['type'], 'SCHEMA')
+            self.assertEqual([message['record']['__typo_record_id'] for message in stream_messages[1:]], record_ids)
+
+        self.assertEqual(messages[-1], {
+            'type': 'STATE',
+            'value': {
+                'bookmarks': {
+                    audit_stream_id: {'__typo_record_id': 4},
+                    dataset_stream_id: {'__typo_record_id': 2}
+                }
+            }
+        })
+        self.assertEqual(tap.state, messages[-1]['value'])
+
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    def test_parallel_streams_failure(self):
+        '''
+        Sync two catalog streams at once, one of them failing with a 404 while the other one is being synced.
+        The other stream must stop syncing instead of fetching all its pages.
+        '''
+        audit_started = threading.Event()
+        audit_pages = []
+
+        def mock_get(session, url, headers, params, timeout, stream=False):
+            if '/datasets/mock_dataset/results' in url:
+                audit_started.wait(5)
+                return MockRequestResponse({'message': 'Dataset results not found'}, 404)
+
+            if '/audits/123/results' in url:
+                page = int(url.split('page=')[-1])
+                audit_pages.append(page)
+                audit_started.set()
+                if page == 2:
+                    # Still fetching when the other stream fails
+                    tap.sync_stopped.wait(5)
+
+                record_id = page * 2 - 1
+                return MockRequestResponse(
+                    generate_audit_dataset_response([generate_record(record_id), generate_record(record_id + 1)]),
+                    200, headers={'Link': '; rel="next"' if page < 5 else ''})
+
+            return mock_requests_get_test_parallel_streams(session, url, headers, params, timeout, stream)
+
+        with patch('sys.stdout', new=StringIO()), self.assertLogs(LOGGER, level='INFO'), \
+                patch('tap_typo.typo.requests.Session.get', new=mock_get):
+            catalog = TapTypo(config=generate_config()).catalog
+            for stream in catalog['streams']:
+                stream['metadata'][0]['metadata']['selected'] = True
+
+        with patch('sys.stdout', new=StringIO()), self.assertLogs(LOGGER, level='INFO') as log, \
+                patch('tap_typo.typo.requests.Session.get', new=mock_get):
+            tap = TapTypo(config=generate_config(records_per_page=2, max_parallel_streams=2), catalog=catalog)
+            with self.assertRaises(SystemExit):
+                tap.sync(catalog_mode=True)
+
+        self.assertLessEqual(max(audit_pages), 2)
+        self.assertTrue(any('Dataset results not found' in line for line in log.output))
+        self.assertFalse(any('Finished syncing all available data' in line for line in log.output))
+
+    @unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    @patch('tap_typo.typo.requests.Session.get', new=mock_requests_get_test_parallel_streams)
+    def test_async_engine(self):
+        '''
+        Sync two catalog streams with the async engine, with pages prefetched.
+        Output must hold the same messages as with the threads engine.
+        '''
+        async def mock_fetch(engine, url, headers, raw=False):
+            # Results pages come from the same mock as the threaded requests
+            response = mock_requests_get_test_parallel_streams(None, url, headers, None, 20)
+            await asyncio.sleep(0)
+            return response.status_code, response.headers, response.content if raw else response.json()
+
+        with patch('sys.stdout', new=StringIO()), self.assertLogs(LOGGER, level='INFO'):
+            catalog = TapTypo(config=generate_config()).catalog
+            for stream in catalog['streams']:
+                stream['metadata'][0]['metadata']['selected'] = True
+
+        outputs = []
+        for engine, parallel_streams, transform_processes in [('threads', 1, 0), ('async', 2, 0), ('async', 2, 2)]:
+            with patch('sys.stdout', new=StringIO()) as mock_stdout, self.assertLogs(LOGGER, level='INFO'), \
+                    patch.object(AsyncEngine, 'fetch', new=mock_fetch):
+                tap = TapTypo(config=generate_config(
+                    records_per_page=2, prefetch_pages=2, engine=engine, max_parallel_streams=parallel_streams,
+                    state_every_records=0, transform_processes=transform_processes), catalog=catalog)
+                tap.sync(catalog_mode=True)
+                outputs.append([json.loads(line) for line in mock_stdout.getvalue().splitlines()])
+
+        threads_messages = outputs[0]
+        for async_messages in outputs[1:]:
+            self.assertEqual(
+                sorted(json.dumps(message) for message in async_messages if message['type'] != 'STATE'),
+                sorted(json.dumps(message) for message in threads_messages if message['type'] != 'STATE'))
+            self.assertEqual(async_messages[-1], threads_messages[-1])
+
+    @unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+    @patch('tap_typo.typo.requests.Session.post', new=mock_requests_post_get_token)
+    def test_async_engine_errors(self):
+        '''
+        The async engine retries gateway errors that have no JSON body and responses cut off while they are read.
+        '''
+        responses = iter([
+            (502, b'<html><body>Bad Gateway</body></html>'),
+            (200, aiohttp.ClientPayloadError('Response payload is not completed')),
+            (200, b'{"data": {"records": []}}')
+        ])
+
+        class MockResponse():
+            def __init__(self, status, body):
+                self.status = status
+                self.headers = {}
+                self.body = body
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc_info):
+                return False
+
+            async def read(self):
+                if isinstance(self.body, Exception):
+                    raise self.body
+                return self.body
+
+        class MockSession():  # pylint: disable=too-few-public-methods
+            def get(self, url, headers):  # pylint: disable=no-self-use
+                return MockResponse(*next(responses))
+
+        async def no_sleep(delay):
+            pass
+
+        with self.assertLogs(LOGGER, level='INFO') as log, patch('tap_typo.aio.asyncio.sleep', new=no_sleep):
+            tap = TapTypo(config=generate_config(), catalog={'streams': []})
+            engine = AsyncEngine(tap)
+            engine.session = MockSession()
+            loop = asyncio.new_event_loop()
+            try:
+                status, _, data = loop.run_until_complete(engine.get_request('https://typo.ai/results', 'test'))
+            finally:
+                loop.close()
+
+        self.assertEqual((status, data), (200, {'data': {'records': []}}))
+        self.assertEqual(tap.retry_policy.counts['502'], 1)
+        self.assertEqual(tap.retry_policy.counts['connection'], 1)
+        self.assertTrue(any('Response payload is not completed' in line for line in log.output))
+
 
 if __name__ == '__main__':
     unittest.main()
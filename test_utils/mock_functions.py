@@ -35,6 +35,11 @@ Mock functions for testing
 #
 # or by Typo (https://www.typo.ai/).
 
+from io import BytesIO
+import json
+
+import requests
+
 from test_utils.utils import generate_record
 
 
@@ -42,11 +47,12 @@ class MockRequestResponse:  # pylint: disable=too-few-public-methods
     '''
     Mocks requests get/post response
     '''
-    def __init__(self, json_data, status_code, headers=None):
+    def __init__(self, json_data, status_code, headers=None, read_error_after=None):
         self.json_data = json_data
         self.headers = headers if headers else {}
         self.text = ''
         self.status_code = status_code
+        self.read_error_after = read_error_after
 
     def json(self):
         '''
@@ -54,6 +60,39 @@ class MockRequestResponse:  # pylint: disable=too-few-public-methods
         '''
         return self.json_data
 
+    @property
+    def content(self):
+        '''
+        Mocks response.content
+        '''
+        return json.dumps(self.json_data).encode('utf-8')
+
+    @property
+    def raw(self):
+        '''
+        Mocks response.raw for streamed responses
+        '''
+        return BytesIO(json.dumps(self.json_data).encode('utf-8'))
+
+    def iter_content(self, chunk_size=1):
+        '''
+        Mocks response.iter_content(). With `read_error_after`, reading the body
+        fails after that many bytes.
+        '''
+        body = json.dumps(self.json_data).encode('utf-8')
+        end = len(body) if self.read_error_after is None else self.read_error_after
+
+        for start in range(0, end, chunk_size):
+            yield body[start:min(start + chunk_size, end)]
+
+        if self.read_error_after is not None:
+            raise requests.exceptions.ChunkedEncodingError('Connection broken: IncompleteRead')
+
+    def close(self):
+        '''
+        Mocks response.close()
+        '''
+
 
 def generate_streaming_dataset_header_response():
     '''
@@ -340,14 +379,16 @@ def generate_audit_dataset_response(records, data_overrides=None):
     }
 
 
-def mock_requests_post_get_token(url, headers, data, timeout):  # pylint: disable=unused-argument
+# Mocks take the arguments of the requests.Session methods they replace
+# pylint: disable=unused-argument,too-many-arguments
+def mock_requests_post_get_token(session, url, headers, data, timeout):
     '''
     Mock get_token
     '''
     return MockRequestResponse({'token': 'test'}, 200)
 
 
-def mock_requests_get_test_discover_mode(url, headers, params, timeout):  # pylint: disable=unused-argument
+def mock_requests_get_test_discover_mode(session, url, headers, params, timeout, stream=False):
     '''
     Mock get requests for test_discover_mode
     '''
@@ -364,7 +405,7 @@ def mock_requests_get_test_discover_mode(url, headers, params, timeout):  # pyli
     raise Exception('This code should not be reached')
 
 
-def mock_requests_get_test_resume_with_state(url, headers, params, timeout):  # pylint: disable=unused-argument
+def mock_requests_get_test_resume_with_state(session, url, headers, params, timeout, stream=False):
     '''
     Mock get requests for test_resume_with_state
     '''
@@ -372,7 +413,8 @@ def mock_requests_get_test_resume_with_state(url, headers, params, timeout):  #
     if url == 'https://typo.ai/repositories/mock_repository/datasets/mock_dataset/audits/123':
         return MockRequestResponse(generate_audit_dataset_header_response(), 200)
 
-    if url == 'https://typo.ai/repositories/mock_repository/datasets/mock_dataset/audits/123/results?records_per_page=5&page=1&__typo_id=gt:6':
+    if url == ('https://typo.ai/repositories/mock_repository/datasets/mock_dataset/audits/123/results'
+               '?records_per_page=5&page=1&__typo_id=gt:6'):
         # tap-typo will resume from record with id 7
         return MockRequestResponse(generate_audit_dataset_response(
             [generate_record(7, has_errors=True), generate_record(8), generate_record(9),
@@ -388,8 +430,7 @@ def mock_requests_get_test_resume_with_state(url, headers, params, timeout):  #
     raise Exception('This code should not be reached')
 
 
-# pylint: disable=unused-argument
-def mock_requests_get_test_get_simple_streaming_dataset(url, headers, params, timeout):
+def mock_requests_get_test_get_simple_streaming_dataset(session, url, headers, params, timeout, stream=False):
     '''
     Mock get requests for test_get_simple_streaming_dataset
     '''
@@ -414,7 +455,7 @@ def mock_requests_get_test_get_simple_streaming_dataset(url, headers, params, ti
     raise Exception('This code should not be reached')
 
 
-def mock_requests_get_test_get_simple_audit_dataset(url, headers, params, timeout):
+def mock_requests_get_test_get_simple_audit_dataset(session, url, headers, params, timeout, stream=False):
     '''
     Mock get requests for test_get_simple_audit_dataset
     '''
@@ -440,7 +481,7 @@ def mock_requests_get_test_get_simple_audit_dataset(url, headers, params, timeou
     raise Exception('This code should not be reached')
 
 
-def mock_requests_get_test_multi_page_no_limit(url, headers, params, timeout):
+def mock_requests_get_test_multi_page_no_limit(session, url, headers, params, timeout, stream=False):
     '''
     Mock get requests for test_multi_page_no_limit
     '''
@@ -459,7 +500,8 @@ def mock_requests_get_test_multi_page_no_limit(url, headers, params, timeout):
             200, headers={'Link': '; rel="next"'})
 
     # Return 2nd page of results
-    if url == 'https://typo.ai/repositories/mock_repository/datasets/mock_dataset/audits/123/results?records_per_page=2&page=2':
+    if url == ('https://typo.ai/repositories/mock_repository/datasets/mock_dataset/audits/123/results'
+               '?records_per_page=2&page=2'):
         return MockRequestResponse(
             generate_audit_dataset_response(
                 [generate_record(3, has_errors=True), generate_record(4)]
@@ -475,7 +517,7 @@ def mock_requests_get_test_multi_page_no_limit(url, headers, params, timeout):
     raise Exception('This code should not be reached')
 
 
-def mock_requests_get_test_request_token(url, headers, params, timeout):  # pylint: disable=unused-argument
+def mock_requests_get_test_request_token(session, url, headers, params, timeout, stream=False):
     '''
     Mock get requests for test_request_token
     '''
@@ -486,3 +528,71 @@ def mock_requests_get_test_request_token(url, headers, params, timeout):  # pyli
         return MockRequestResponse(generate_audit_listing_response(), 200)
 
     raise Exception('This code should not be reached')
+
+
+def mock_requests_get_test_parallel_streams(session, url, headers, params, timeout, stream=False):
+    '''
+    Mock get requests for test_parallel_streams
+    '''
+    if url == 'https://typo.ai/repositories/mock_repository/datasets/mock_dataset/results?records_per_page=2&page=1':
+        return MockRequestResponse(
+            generate_streaming_dataset_response(
+                [generate_record(1, has_errors=True), generate_record(2)]
+            ),
+            200, headers={'Link': ''})
+
+    if (url == 'https://typo.ai/repositories/mock_repository/datasets/mock_dataset/audits/123/results?'
+            + 'records_per_page=2&page=1'):
+        return MockRequestResponse(
+            generate_audit_dataset_response(
+                [generate_record(1, has_errors=True), generate_record(2)],
+                {'records_per_page': 2, 'total_records': 4}
+            ),
+            200, headers={'Link': '; rel="next"'})
+
+    if (url == 'https://typo.ai/repositories/mock_repository/datasets/mock_dataset/audits/123/results?'
+            + 'records_per_page=2&page=2'):
+        return MockRequestResponse(
+            generate_audit_dataset_response(
+                [generate_record(3, has_errors=True), generate_record(4)]
+            ),
+            200, headers={'Link': ''})
+
+    if url == 'https://typo.ai/datasets':
+        return MockRequestResponse(generate_dataset_listing_response(), 200)
+
+    if url == 'https://typo.ai/audits':
+        return MockRequestResponse(generate_audit_listing_response(), 200)
+
+    raise Exception('This code should not be reached')
+
+
+def mock_requests_get_test_keyset_pagination(session, url, headers, params, timeout, stream=False):
+    '''
+    Mock get requests for test_keyset_pagination
+    '''
+    results_url = 'https://typo.ai/repositories/mock_repository/datasets/mock_dataset/audits/123/results'
+
+    if url == results_url + '?records_per_page=2&page=1':
+        return MockRequestResponse(
+            generate_audit_dataset_response([generate_record(1, has_errors=True), generate_record(2)]),
+            200, headers={'Link': '; rel="next"'})
+
+    if url == results_url + '?records_per_page=2&page=1&__typo_id=gt:2':
+        return MockRequestResponse(
+            generate_audit_dataset_response([generate_record(3, has_errors=True), generate_record(4)]),
+            200, headers={'Link': '; rel="next"'})
+
+    # Short page, there is nothing after it
+    if url == results_url + '?records_per_page=2&page=1&__typo_id=gt:4':
+        return MockRequestResponse(
+            generate_audit_dataset_response([generate_record(5)]),
+            200, headers={'Link': '; rel="next"'})
+
+    if url == 'https://typo.ai/datasets':
+        return MockRequestResponse(generate_dataset_listing_response(), 200)
+
+    if url == 'https://typo.ai/audits':
+        return MockRequestResponse(generate_audit_listing_response(), 200)
+
+    raise Exception('This code should not be reached')
@@ -70,7 +70,8 @@ TEST_DISCOVER_MODE_OUTPUT = '''{
             "valid-replication-keys": [
               "__typo_record_id"
             ],
-            "selected-by-default": false
+            "selected-by-default": false,
+            "updated-at": "2020-01-01T01:01:01.000Z"
           }
         },
         {
@@ -79,7 +80,7 @@ TEST_DISCOVER_MODE_OUTPUT = '''{
             "__typo_result"
           ],
           "metadata": {
-            "inclusion": "available",
+            "inclusion": "automatic",
             "selected-by-default": true,
             "sql-datatype": "varchar(255)"
           }
@@ -148,7 +149,8 @@ TEST_DISCOVER_MODE_OUTPUT = '''{
             "valid-replication-keys": [
               "__typo_record_id"
             ],
-            "selected-by-default": false
+            "selected-by-default": false,
+            "updated-at": "2020-01-01T01:01:01.000Z"
           }
         },
         {
@@ -179,7 +181,7 @@ TEST_DISCOVER_MODE_OUTPUT = '''{
             "__typo_result"
           ],
           "metadata": {
-            "inclusion": "available",
+            "inclusion": "automatic",
             "selected-by-default": true,
             "sql-datatype": "varchar(255)"
           }